@@ -19,9 +19,39 @@ fi
 promoted=false
 
 number=$(git log --oneline master ^`git describe --tags --abbrev=0` | wc -l)
-changes=$(git log --pretty='%H<<<%s>>>' -"$number" | sed ':a;N;$!ba;s/\n//g')
+# a json list of {commit, message}, the server takes the first line as summary
+changes=$(git log -z --format='%H%n%B' -"$number" | jq -Rs 'split("\u0000") | map(select(length > 0) | index("\n") as $i | {commit: .[:$i], message: (.[$i + 1:] | rtrimstr("\n"))})')
 jar_name="leaves-$mcversion.jar"
 jar_sha256=`sha256 $jar_name`
 
-curl --location --request POST "https://api.leavesmc.top/new_release" --header "Content-Type: application/json" --data-raw "{\"project_id\":\"$project_id\",\"project_name\":\"$project_name\",\"version\":\"$mcversion\",\"time\":\"$ctime\",\"channel\":\"$channel\",\"promoted\":$promoted,\"changes\":\"$changes\",\"downloads\":{\"application\":{\"name\":\"$jar_name\",\"sha256\":\"$jar_sha256\",\"url\":\"https://github.com/LeavesMC/Leaves/releases/download/$tag/$jar_name\"}},\"secret\":\"$secret\"}"
-curl --location --request POST "https://api.leavesmc.top/upload_file" -F "file=@$jar_name" -F "filename=$jar_name" -F "filehash=$jar_sha256" -F "secret=$secret"
\ No newline at end of file
+release=$(jq -n \
+  --arg project_id "$project_id" --arg project_name "$project_name" --arg version "$mcversion" \
+  --arg time "$ctime" --arg channel "$channel" --argjson promoted $promoted --argjson changes "$changes" \
+  --arg name "$jar_name" --arg sha256 "$jar_sha256" --arg url "https://github.com/LeavesMC/Leaves/releases/download/$tag/$jar_name" \
+  --arg secret "$secret" \
+  '{project_id: $project_id, project_name: $project_name, version: $version, time: $time, channel: $channel, promoted: $promoted, changes: $changes, downloads: {application: {name: $name, sha256: $sha256, url: $url}}, secret: $secret}') || exit 1
+
+curl --fail --location --request POST "https://api.leavesmc.top/new_release" --header "Content-Type: application/json" --data-raw "$release" || exit 1
+
+# resumable chunked upload, a failed chunk is retried on its own
+chunk_size=$((16 * 1024 * 1024))
+jar_size=$(stat -c %s "$jar_name")
+upload_id=$(curl --silent --fail --request POST "https://api.leavesmc.top/uploads" --header "X-Secret: $secret" --header "Content-Type: application/json" --data-raw "{\"filename\":\"$jar_name\",\"size\":$jar_size,\"sha256\":\"$jar_sha256\"}" | sed 's/.*"id":"\([0-9a-f]*\)".*/\1/')
+if [ -z "$upload_id" ]; then
+  echo "could not create an upload for $jar_name" >&2
+  exit 1
+fi
+chunk=0
+while [ $((chunk * chunk_size)) -lt "$jar_size" ]; do
+  uploaded=false
+  for attempt in 1 2 3 4 5; do
+    dd if="$jar_name" bs=$chunk_size skip=$chunk count=1 status=none | curl --silent --fail --request PUT "https://api.leavesmc.top/uploads/$upload_id?offset=$((chunk * chunk_size))" --header "X-Secret: $secret" --data-binary @- > /dev/null && uploaded=true && break
+    sleep $attempt
+  done
+  if [ $uploaded != "true" ]; then
+    echo "chunk $chunk of $jar_name failed after 5 attempts" >&2
+    exit 1
+  fi
+  chunk=$((chunk + 1))
+done
+curl --fail --location --request POST "https://api.leavesmc.top/uploads/$upload_id/finalize" --header "X-Secret: $secret" || exit 1
\ No newline at end of file
@@ -0,0 +1,116 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Optional
+
+logger = logging.getLogger("leavesmc.access")
+logger.propagate = False
+
+# span name -> milliseconds, for the request being handled
+_spans: ContextVar[Optional[dict]] = ContextVar("spans", default=None)
+
+
+@contextmanager
+def span(name: str):
+    """Add the time spent inside the block to the current request's ``name`` span.
+
+    Outside of a logged request this does nothing.
+    """
+    spans = _spans.get()
+    if spans is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans[name] = spans.get(name, 0) + (time.perf_counter() - start) * 1000
+
+
+def begin_request():
+    spans = {}
+    return spans, _spans.set(spans)
+
+
+def end_request(token):
+    _spans.reset(token)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(record.msg, ensure_ascii=False, separators=(",", ":"))
+
+
+# failures of background work; stderr ends up in syslog under systemd
+events = logging.getLogger("leavesmc.events")
+events.propagate = False
+_events_handler = logging.StreamHandler()
+_events_handler.setFormatter(JsonFormatter())
+events.addHandler(_events_handler)
+events.setLevel(logging.INFO)
+
+
+def log_event(event: str, level: int = logging.ERROR, **fields):
+    events.log(
+        level,
+        {
+            "time": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "level": logging.getLevelName(level),
+            "event": event,
+            **fields,
+        },
+    )
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord):
+        # entries are plain dicts; leave the json encoding to the listener thread
+        return record
+
+
+class AccessLog:
+    """JSON access log written from a background thread, with sampling.
+
+    Requests that fail with a 5xx status or take longer than ``slow_ms`` are always
+    logged, the rest with probability ``sample_rate``.
+    """
+
+    def __init__(self, path: str = "", sample_rate: float = 0.1, slow_ms: float = 500):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            # reopens the file once logrotate moved it away
+            target = logging.handlers.WatchedFileHandler(path)
+        else:
+            target = logging.StreamHandler()
+        target.setFormatter(JsonFormatter())
+        log_queue = queue.SimpleQueue()
+        self._handler = _QueueHandler(log_queue)
+        self._listener = logging.handlers.QueueListener(log_queue, target)
+
+    def start(self):
+        logger.addHandler(self._handler)
+        logger.setLevel(logging.INFO)
+        self._listener.start()
+
+    def stop(self):
+        logger.removeHandler(self._handler)
+        self._listener.stop()
+
+    def sampled(self, status: int, duration_ms: float) -> bool:
+        return (
+            status >= 500
+            or duration_ms >= self.slow_ms
+            or random.random() < self.sample_rate
+        )
+
+    def log(self, entry: dict):
+        logger.info(entry)
@@ -0,0 +1,205 @@
+import errno
+import fcntl
+import os
+import shutil
+import tempfile
+import time
+from typing import Dict, Iterable, List, Set, Tuple
+
+from fastapi.staticfiles import StaticFiles
+
+CACHE_DIR = "cache"
+OBJECTS = "objects"
+BUILDS = "builds"
+CHUNK_SIZE = 65536
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+MUTABLE = "public, max-age=60"
+# objects younger than this may still be waiting for their first link
+GRACE_SECONDS = 600
+
+
+def object_path(sha256: str) -> str:
+    """Path of the content with ``sha256``, relative to the cache directory."""
+    return f"{OBJECTS}/{sha256[:2]}/{sha256}"
+
+
+def build_path(project: str, version: str, build: int, name: str) -> str:
+    """Per-build address of an artifact, relative to the cache directory."""
+    return f"{BUILDS}/{project}/{version}/{build}/{name}"
+
+
+def _abs(path: str) -> str:
+    return os.path.join(CACHE_DIR, path)
+
+
+def has_object(sha256: str) -> bool:
+    return os.path.isfile(_abs(object_path(sha256)))
+
+
+def temp_file() -> Tuple[int, str]:
+    """A scratch file on the cache's filesystem, so it can be moved in atomically."""
+    return tempfile.mkstemp(dir=CACHE_DIR, prefix=".tmp-")
+
+
+def put_object(src: str, sha256: str) -> str:
+    """Move an already verified file into the store; a duplicate is dropped."""
+    path = object_path(sha256)
+    if has_object(sha256):
+        os.remove(src)
+        return path
+    os.makedirs(os.path.dirname(_abs(path)), exist_ok=True)
+    os.replace(src, _abs(path))
+    return path
+
+
+def copy_object(src: str, sha256: str) -> str:
+    """Copy an already verified file into the store."""
+    if has_object(sha256):
+        return object_path(sha256)
+    fd, tmp = temp_file()
+    try:
+        with os.fdopen(fd, "wb") as f, open(src, "rb") as s:
+            shutil.copyfileobj(s, f, CHUNK_SIZE)
+        return put_object(tmp, sha256)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _link(sha256: str, dest: str):
+    # hardlinks keep the object's link count equal to the names pointing at it,
+    # which is what eviction goes by
+    src = _abs(object_path(sha256))
+    os.makedirs(os.path.dirname(_abs(dest)), exist_ok=True)
+    # a random name per call, os.link can not replace so the file goes first
+    fd, tmp = temp_file()
+    os.close(fd)
+    os.remove(tmp)
+    try:
+        try:
+            os.link(src, tmp)
+        except OSError as e:
+            # another filesystem, or one without hardlinks
+            if e.errno not in (errno.EXDEV, errno.EPERM):
+                raise
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, _abs(dest))
+    finally:
+        # rename is a no-op when dest is already a link to the same object
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+
+
+def link_build(sha256: str, project: str, version: str, build: int, name: str) -> str:
+    path = build_path(project, version, build, name)
+    if not os.path.isfile(_abs(path)):
+        _link(sha256, path)
+    return path
+
+
+def publish_alias(sha256: str, alias: str):
+    """Point the mutable ``cache/<alias>`` name at the object ``sha256``."""
+    _link(sha256, alias)
+
+
+def adopt_legacy(sha256: str, name: str):
+    """Move a file mirrored under the old ``cache/<sha256>/<name>`` layout into the store."""
+    legacy = _abs(f"{sha256}/{name}")
+    if os.path.isfile(legacy):
+        put_object(legacy, sha256)
+        try:
+            os.rmdir(os.path.dirname(legacy))
+        except OSError:
+            pass
+
+
+def evict(
+    keep: Dict[Tuple[str, str], Set[int]],
+    links: Dict[str, List[str]],
+    max_bytes: int,
+) -> None:
+    """Drop per-build links outside ``keep``, then objects nothing links to any more.
+
+    ``keep`` maps (project, version) to the builds whose links stay. When the
+    remaining objects still exceed ``max_bytes`` (0 disables the bound), the least
+    recently read ones are removed along with every name in ``links[sha256]`` and
+    any alias pointing at them. Only one worker evicts at a time.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(_abs(".evict.lock"), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        for (project, version), builds in keep.items():
+            _evict_builds(_abs(f"{BUILDS}/{project}/{version}"), builds)
+        objects = _evict_objects()
+        if max_bytes:
+            _evict_lru(objects, links, max_bytes)
+
+
+def _evict_builds(dir: str, keep: Set[int]):
+    if not os.path.isdir(dir):
+        return
+    for entry in os.scandir(dir):
+        if entry.is_dir() and entry.name.isdigit() and int(entry.name) not in keep:
+            shutil.rmtree(entry.path)
+
+
+def _evict_objects() -> List[Tuple[float, int, int, str]]:
+    """Remove objects without any other name; returns (atime, size, inode, sha256) of the rest."""
+    objects = []
+    root = _abs(OBJECTS)
+    if not os.path.isdir(root):
+        return objects
+    grace = time.time() - GRACE_SECONDS
+    for prefix in os.scandir(root):
+        for entry in os.scandir(prefix.path):
+            st = entry.stat()
+            if st.st_nlink <= 1 and st.st_mtime < grace:
+                os.remove(entry.path)
+            else:
+                objects.append((st.st_atime, st.st_size, st.st_ino, entry.name))
+        if not any(os.scandir(prefix.path)):
+            os.rmdir(prefix.path)
+    return objects
+
+
+def _evict_lru(objects, links: Dict[str, List[str]], max_bytes: int):
+    total = sum(size for _, size, _, _ in objects)
+    if total <= max_bytes:
+        return
+    aliases: Dict[int, List[str]] = {}
+    for entry in os.scandir(CACHE_DIR):
+        if entry.is_file() and not entry.name.startswith("."):
+            aliases.setdefault(entry.stat().st_ino, []).append(entry.path)
+    for _, size, inode, sha256 in sorted(objects):
+        if total <= max_bytes:
+            break
+        for path in _names(links.get(sha256, ()), aliases.get(inode, ())):
+            if os.path.exists(path):
+                os.remove(path)
+        for path in links.get(sha256, ()):
+            try:
+                os.rmdir(os.path.dirname(_abs(path)))
+            except OSError:
+                pass
+        os.remove(_abs(object_path(sha256)))
+        total -= size
+
+
+def _names(links: Iterable[str], aliases: Iterable[str]):
+    yield from (_abs(path) for path in links)
+    yield from aliases
+
+
+class CacheStaticFiles(StaticFiles):
+    """Serves the cache with long-lived caching for content that never changes."""
+
+    async def get_response(self, path: str, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code < 400:
+            immutable = path.startswith((OBJECTS + os.sep, BUILDS + os.sep))
+            response.headers["Cache-Control"] = IMMUTABLE if immutable else MUTABLE
+        return response
@@ -0,0 +1,64 @@
+"""Per-request cost of counting a download, and of draining the counts.
+
+    python benchmarks/download_counter.py [hits]
+"""
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from download_stats import DownloadCounter  # noqa: E402
+from release_index import BuildRecord, DownloadRecord  # noqa: E402
+
+BUILDS = 500
+
+
+def make_downloads():
+    downloads = []
+    for build in range(1, BUILDS + 1):
+        record = BuildRecord(
+            "leaves",
+            "leaves",
+            "1.20.1",
+            "1.20",
+            build,
+            datetime(2023, 7, 1),
+            "default",
+            False,
+        )
+        for type in ("application", "mojmap"):
+            download = DownloadRecord(type, f"leaves-{type}.jar", f"{build:064x}", "")
+            download.build_record = record
+            downloads.append(download)
+    return downloads
+
+
+def main():
+    hits = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    downloads = make_downloads()
+    # most traffic goes to the latest builds
+    picks = [downloads[-1 - (i * 7) % 40] for i in range(hits)]
+    counter = DownloadCounter()
+
+    start = time.perf_counter()
+    for download in picks:
+        pass
+    baseline = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for download in picks:
+        counter.hit(download)
+    elapsed = time.perf_counter() - start - baseline
+
+    start = time.perf_counter()
+    rows = counter.drain()
+    drained = time.perf_counter() - start
+
+    print(f"hit:   {elapsed / hits * 1e9:.0f} ns per download ({hits} downloads)")
+    print(f"drain: {drained * 1e6:.0f} us for {len(rows)} rows")
+
+
+if __name__ == "__main__":
+    main()
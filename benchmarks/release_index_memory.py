@@ -0,0 +1,109 @@
+"""Memory footprint and per-request cost of the release index for 10k builds.
+
+    python benchmarks/release_index_memory.py [builds]
+"""
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from release_index import ReleaseIndex, render_json  # noqa: E402
+
+BUILDS_PER_VERSION = 50
+COMMITS_PER_BUILD = 3
+
+
+def make_rows(builds: int):
+    start = datetime(2023, 6, 1)
+    project_rows, file_rows, commit_rows = [], [], []
+    for build in range(1, builds + 1):
+        group = f"1.{20 + build // (BUILDS_PER_VERSION * 4)}"
+        version = f"{group}.{build // BUILDS_PER_VERSION % 4}"
+        project_rows.append(
+            SimpleNamespace(
+                project_id="leaves",
+                project_name="leaves",
+                version=version,
+                version_group=group,
+                build=build,
+                time=start + timedelta(hours=build),
+                channel="default",
+                promoted=False,
+            )
+        )
+        sha256 = f"{build:064x}"
+        file_rows.append(
+            SimpleNamespace(
+                project_id="leaves",
+                version=version,
+                build=build,
+                type="application",
+                name=f"leaves-{version}.jar",
+                sha256=sha256,
+                url=f"https://github.com/LeavesMC/Leaves/releases/download/{version}-{sha256[:7]}/leaves-{version}.jar",
+            )
+        )
+        for i in range(COMMITS_PER_BUILD):
+            commit_rows.append(
+                SimpleNamespace(
+                    project_id="leaves",
+                    version=version,
+                    build=build,
+                    hash=f"{build:032x}{i:08x}",
+                    summary=f"Commit {i} of build {build}",
+                    message=f"Commit {i} of build {build}\n",
+                )
+            )
+    return project_rows, file_rows, commit_rows
+
+
+def legacy_listing(builds):
+    # what the handlers used to allocate for every builds listing request
+    return {
+        "project_id": "leaves",
+        "project_name": "leaves",
+        "version": builds[0].version,
+        "builds": [record.to_dict() for record in builds],
+    }
+
+
+def main(builds: int = 10000):
+    rows = make_rows(builds)
+
+    tracemalloc.start()
+    index = ReleaseIndex.from_rows(*rows)
+    index_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"index for {builds} builds: {index_bytes / 1024 / 1024:.2f} MiB")
+
+    key = max(index.by_version, key=lambda key: len(index.by_version[key]))
+    listing = index.by_version[key]
+    cache_key = ("version_builds",) + key
+    legacy = lambda: render_json(legacy_listing(listing))
+    cached = lambda: index.rendered(cache_key, lambda: legacy_listing(listing))
+    cached()
+    rounds = 2000
+
+    print(f"builds listing of {len(listing)} builds, {rounds} requests:")
+    for name, request in (("render per request", legacy), ("cached body", cached)):
+        begin = time.perf_counter()
+        for _ in range(rounds):
+            request()
+        elapsed = time.perf_counter() - begin
+
+        tracemalloc.start()
+        request()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            f"  {name:<20}{elapsed / rounds * 1e6:8.1f} us, "
+            f"allocated {peak / 1024:8.1f} KiB per request"
+        )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
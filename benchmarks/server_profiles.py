@@ -0,0 +1,158 @@
+"""Throughput and latency of the uvicorn profiles WebConfig can select.
+
+    python benchmarks/server_profiles.py [seconds] [connections]
+
+Each profile runs in its own server process and serves a pre-rendered JSON body
+the size of a build listing, the way the index-backed routes do, to clients that
+keep their connections alive. Profiles whose loop or http implementation is not
+installed are skipped.
+"""
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fastapi import FastAPI, Response  # noqa: E402
+
+from config import WebConfig  # noqa: E402
+
+PORT = 18000
+SOCKET = "/tmp/leavesmc-webapi-bench.sock"
+PROFILES = {
+    "default": {},
+    "uvloop+httptools": {"loop": "uvloop", "http": "httptools"},
+    "unix socket": {"uds": SOCKET},
+    "keep-alive 75s": {"timeout_keep_alive": 75},
+    "limit_concurrency 32": {"limit_concurrency": 32},
+    f"{os.cpu_count()} workers": {"workers": os.cpu_count()},
+}
+
+app = FastAPI()
+BODY = json.dumps(
+    {
+        "builds": [
+            {"build": build, "time": "2023-07-01T00:00:00.000Z", "changes": []}
+            for build in range(200)
+        ]
+    }
+).encode("utf-8")
+
+
+@app.get("/projects/leaves/versions/1.20.1/builds")
+async def builds():
+    return Response(content=BODY, media_type="application/json")
+
+
+DEFAULTS = dict(WebConfig.to_dict(), host="127.0.0.1", port=PORT)
+
+
+def configure(profile: dict):
+    for key, value in dict(DEFAULTS, **profile).items():
+        setattr(WebConfig, key, value)
+    WebConfig.validate()
+
+
+def serve(profile: dict):
+    import uvicorn
+
+    configure(profile)
+    uvicorn.run(
+        "server_profiles:app",
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+        access_log=False,
+        log_level="warning",
+        **WebConfig.uvicorn_options(),
+    )
+
+
+async def connect(uds: str):
+    if uds:
+        return await asyncio.open_unix_connection(uds)
+    return await asyncio.open_connection("127.0.0.1", PORT)
+
+
+async def wait_ready(uds: str, timeout: float = 15):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await connect(uds)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def client(uds: str, deadline: float, latencies: list):
+    reader, writer = await connect(uds)
+    request = (
+        b"GET /projects/leaves/versions/1.20.1/builds HTTP/1.1\r\n"
+        b"Host: bench\r\n\r\n"
+    )
+    try:
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            writer.write(request)
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in head.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":", 1)[1])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+async def drive(uds: str, seconds: float, connections: int) -> list:
+    await wait_ready(uds)
+    latencies: list = []
+    deadline = time.monotonic() + seconds
+    await asyncio.gather(
+        *(client(uds, deadline, latencies) for _ in range(connections))
+    )
+    return latencies
+
+
+def run(name: str, profile: dict, seconds: float, connections: int):
+    try:
+        configure(profile)
+    except AssertionError as e:
+        print(f"{name:24} skipped: {e}")
+        return
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", json.dumps(profile)]
+    )
+    try:
+        latencies = asyncio.run(drive(WebConfig.uds, seconds, connections))
+    finally:
+        server.terminate()
+        server.wait()
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)]
+    print(
+        f"{name:24} {len(latencies) / seconds:9.0f} req/s"
+        f"   median {statistics.median(latencies) * 1000:6.2f} ms"
+        f"   p99 {p99 * 1000:6.2f} ms"
+    )
+
+
+def main():
+    if sys.argv[1:2] == ["--serve"]:
+        serve(json.loads(sys.argv[2]))
+        return
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    connections = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    print(f"{connections} keep-alive connections, {seconds:g}s per profile")
+    for name, profile in PROFILES.items():
+        run(name, profile, seconds, connections)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import json
+import re
+from typing import Iterator, List, Union
+
+from release_index import CommitRecord
+
+HASH_RE = re.compile(r"^[0-9a-f]{7,40}$")
+# bytes that fit commit_info.summary (TEXT) and commit_info.message (MEDIUMTEXT)
+MAX_SUMMARY = 65535
+MAX_MESSAGE = 16777215
+
+
+class ChangelogError(ValueError):
+    pass
+
+
+def _record(item) -> CommitRecord:
+    if not isinstance(item, dict):
+        raise ChangelogError(f"change must be an object, got {item!r}")
+    hash = item.get("commit")
+    message = item.get("message", "")
+    if not isinstance(hash, str) or not HASH_RE.match(hash.lower()):
+        raise ChangelogError(f"invalid commit hash {hash!r}")
+    if not isinstance(message, str):
+        raise ChangelogError(f"message of {hash} must be a string")
+    summary = item.get("summary") or message.split("\n", 1)[0]
+    if not isinstance(summary, str):
+        raise ChangelogError(f"summary of {hash} must be a string")
+    if len(summary.encode("utf-8")) > MAX_SUMMARY:
+        raise ChangelogError(f"summary of {hash} is longer than {MAX_SUMMARY} bytes")
+    if len(message.encode("utf-8")) > MAX_MESSAGE:
+        raise ChangelogError(f"message of {hash} is longer than {MAX_MESSAGE} bytes")
+    return CommitRecord(hash.lower(), summary, message)
+
+
+def _iter_json(payload: str) -> Iterator[dict]:
+    # NDJSON, or any whitespace separated sequence of objects, one at a time
+    decoder = json.JSONDecoder()
+    pos, end = 0, len(payload)
+    while True:
+        while pos < end and payload[pos].isspace():
+            pos += 1
+        if pos == end:
+            return
+        try:
+            item, pos = decoder.raw_decode(payload, pos)
+        except json.JSONDecodeError as e:
+            raise ChangelogError(f"invalid changelog json: {e}") from None
+        yield item
+
+
+def _iter_legacy(payload: str) -> Iterator[dict]:
+    # "<hash><<<<message>>>" repeated, as PushToAPI.sh used to send it
+    *entries, rest = payload.split(">>>")
+    if rest.strip():
+        raise ChangelogError(f"changelog entry without closing '>>>': {rest!r}")
+    for entry in entries:
+        hash, sep, message = entry.partition("<<<")
+        if not sep:
+            raise ChangelogError(f"invalid changelog entry {entry!r}")
+        yield {"commit": hash.strip(), "summary": message, "message": message}
+
+
+def parse_changes(payload: Union[str, List[dict]]) -> List[CommitRecord]:
+    """Read the ``changes`` of a release in the order given, dropping repeated commits.
+
+    Accepts a list of ``{"commit", "summary", "message"}`` objects, the same
+    objects as NDJSON, or the legacy ``>>>``/``<<<`` delimited string. A missing
+    summary defaults to the first line of the message.
+    """
+    if isinstance(payload, list):
+        items = iter(payload)
+    elif payload.lstrip().startswith(("{", "[")):
+        items = _iter_json(payload)
+    else:
+        items = _iter_legacy(payload)
+    changes: List[CommitRecord] = []
+    seen = set()
+    for item in items:
+        if isinstance(item, list):
+            # a json array sent as a string
+            for record in parse_changes(item):
+                if record.hash not in seen:
+                    seen.add(record.hash)
+                    changes.append(record)
+            continue
+        record = _record(item)
+        if record.hash not in seen:
+            seen.add(record.hash)
+            changes.append(record)
+    return changes
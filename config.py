@@ -1,3 +1,4 @@
+import importlib.util
 import json
 import os
 
@@ -47,12 +48,28 @@ class MysqlConfig:
 class WebConfig:
     host: str = "0.0.0.0"
     port: int = 8000
+    uds: str = ""  # bind a unix socket for nginx instead of host:port
+    workers: int = 1
+    loop: str = "auto"  # "auto", "asyncio" or "uvloop"
+    http: str = "auto"  # "auto", "h11" or "httptools"
+    backlog: int = 2048
+    timeout_keep_alive: int = 5
+    limit_concurrency: int = 0  # 0 means unlimited, otherwise excess gets 503
+    h11_max_incomplete_event_size: int = 16384
 
     @classmethod
     def to_dict(cls):
         return {
             "host": cls.host,
             "port": cls.port,
+            "uds": cls.uds,
+            "workers": cls.workers,
+            "loop": cls.loop,
+            "http": cls.http,
+            "backlog": cls.backlog,
+            "timeout_keep_alive": cls.timeout_keep_alive,
+            "limit_concurrency": cls.limit_concurrency,
+            "h11_max_incomplete_event_size": cls.h11_max_incomplete_event_size,
         }
 
     @classmethod
@@ -71,6 +88,58 @@ class WebConfig:
             data = json.load(fd)
         cls.host = checktyp(data.get("host"), str)
         cls.port = checktyp(data.get("port"), int)
+        # older files only have host and port
+        cls.uds = checktyp(data.get("uds", cls.uds), str)
+        cls.workers = checktyp(data.get("workers", cls.workers), int)
+        cls.loop = checktyp(data.get("loop", cls.loop), str)
+        cls.http = checktyp(data.get("http", cls.http), str)
+        cls.backlog = checktyp(data.get("backlog", cls.backlog), int)
+        cls.timeout_keep_alive = checktyp(
+            data.get("timeout_keep_alive", cls.timeout_keep_alive), int
+        )
+        cls.limit_concurrency = checktyp(
+            data.get("limit_concurrency", cls.limit_concurrency), int
+        )
+        cls.h11_max_incomplete_event_size = checktyp(
+            data.get(
+                "h11_max_incomplete_event_size", cls.h11_max_incomplete_event_size
+            ),
+            int,
+        )
+        cls.validate()
+
+    @classmethod
+    def validate(cls):
+        assert 0 < cls.port < 65536
+        assert cls.workers >= 1
+        assert cls.loop in ("auto", "asyncio", "uvloop")
+        assert cls.http in ("auto", "h11", "httptools")
+        assert cls.backlog > 0 and cls.timeout_keep_alive > 0
+        assert cls.limit_concurrency >= 0
+        assert cls.h11_max_incomplete_event_size > 0
+        # "auto" falls back silently, an explicit choice has to be installed
+        if cls.loop == "uvloop":
+            assert importlib.util.find_spec("uvloop"), "uvloop is not installed"
+        if cls.http == "httptools":
+            assert importlib.util.find_spec("httptools"), "httptools is not installed"
+
+    @classmethod
+    def uvicorn_options(cls) -> dict:
+        options = {
+            "workers": cls.workers,
+            "loop": cls.loop,
+            "http": cls.http,
+            "backlog": cls.backlog,
+            "timeout_keep_alive": cls.timeout_keep_alive,
+            "limit_concurrency": cls.limit_concurrency or None,
+            "h11_max_incomplete_event_size": cls.h11_max_incomplete_event_size,
+        }
+        if cls.uds:
+            options["uds"] = cls.uds
+        else:
+            options["host"] = cls.host
+            options["port"] = cls.port
+        return options
 
 class CDNConfig:
     private_key: str = ""
@@ -98,4 +167,313 @@ class CDNConfig:
         with open(target, "r") as fd:
             data = json.load(fd)
         cls.private_key = checktyp(data.get("private_key"), str)
-        cls.public_key = checktyp(data.get("public_key"), str)
\ No newline at end of file
+        cls.public_key = checktyp(data.get("public_key"), str)
+
+class RateLimitConfig:
+    enabled: bool = False  # behind nginx, enable only together with trust_forwarded
+    rate: float = 10.0  # tokens refilled per second
+    burst: int = 40
+    max_clients: int = 65536
+    trust_forwarded: bool = False  # use X-Real-IP / X-Forwarded-For set by nginx
+
+    @classmethod
+    def to_dict(cls):
+        return {
+            "enabled": cls.enabled,
+            "rate": cls.rate,
+            "burst": cls.burst,
+            "max_clients": cls.max_clients,
+            "trust_forwarded": cls.trust_forwarded,
+        }
+
+    @classmethod
+    def save(cls, target="./config/ratelimit.config.json"):
+        os.makedirs("config", exist_ok=True)
+        with open(target, "w") as fd:
+            json.dump(cls.to_dict(), fd)
+
+    @classmethod
+    def load(cls, target="./config/ratelimit.config.json"):
+        if not os.path.exists(target):
+            cls.save(target=target)
+            return
+        data: dict
+        with open(target, "r") as fd:
+            data = json.load(fd)
+        cls.enabled = checktyp(data.get("enabled"), bool)
+        cls.rate = float(checktyp(data.get("rate"), (int, float)))
+        cls.burst = checktyp(data.get("burst"), int)
+        cls.max_clients = checktyp(data.get("max_clients"), int)
+        cls.trust_forwarded = checktyp(data.get("trust_forwarded"), bool)
+        assert cls.rate > 0 and cls.burst >= 1 and cls.max_clients > 0
+
+
+class MirrorConfig:
+    enabled: bool = True
+    fetcher: str = "http"  # "http" or "local"
+    local_root: str = "./artifacts"  # read by the local fetcher
+    timeout: float = 60.0
+
+    @classmethod
+    def to_dict(cls):
+        return {
+            "enabled": cls.enabled,
+            "fetcher": cls.fetcher,
+            "local_root": cls.local_root,
+            "timeout": cls.timeout,
+        }
+
+    @classmethod
+    def save(cls, target="./config/mirror.config.json"):
+        os.makedirs("config", exist_ok=True)
+        with open(target, "w") as fd:
+            json.dump(cls.to_dict(), fd)
+
+    @classmethod
+    def load(cls, target="./config/mirror.config.json"):
+        if not os.path.exists(target):
+            cls.save(target=target)
+            return
+        data: dict
+        with open(target, "r") as fd:
+            data = json.load(fd)
+        cls.enabled = checktyp(data.get("enabled"), bool)
+        cls.fetcher = checktyp(data.get("fetcher"), str)
+        assert cls.fetcher in ("http", "local")
+        cls.local_root = checktyp(data.get("local_root"), str)
+        cls.timeout = float(checktyp(data.get("timeout"), (int, float)))
+
+
+class LogConfig:
+    enabled: bool = True
+    # a file, not stderr: the service unit sends stderr to syslog; empty logs there
+    path: str = "./logs/access.log"
+    sample_rate: float = 0.1
+    slow_ms: float = 500.0  # slower requests are always logged
+
+    @classmethod
+    def to_dict(cls):
+        return {
+            "enabled": cls.enabled,
+            "path": cls.path,
+            "sample_rate": cls.sample_rate,
+            "slow_ms": cls.slow_ms,
+        }
+
+    @classmethod
+    def save(cls, target="./config/log.config.json"):
+        os.makedirs("config", exist_ok=True)
+        with open(target, "w") as fd:
+            json.dump(cls.to_dict(), fd)
+
+    @classmethod
+    def load(cls, target="./config/log.config.json"):
+        if not os.path.exists(target):
+            cls.save(target=target)
+            return
+        data: dict
+        with open(target, "r") as fd:
+            data = json.load(fd)
+        cls.enabled = checktyp(data.get("enabled"), bool)
+        cls.path = checktyp(data.get("path"), str)
+        cls.sample_rate = float(checktyp(data.get("sample_rate"), (int, float)))
+        assert 0 <= cls.sample_rate <= 1
+        cls.slow_ms = float(checktyp(data.get("slow_ms"), (int, float)))
+
+
+class ProfileConfig:
+    allow_header: bool = False  # profile requests sent with X-Profile: <secret>
+    dump_dir: str = "./profiles"
+    max_seconds: float = 300.0
+
+    @classmethod
+    def to_dict(cls):
+        return {
+            "allow_header": cls.allow_header,
+            "dump_dir": cls.dump_dir,
+            "max_seconds": cls.max_seconds,
+        }
+
+    @classmethod
+    def save(cls, target="./config/profile.config.json"):
+        os.makedirs("config", exist_ok=True)
+        with open(target, "w") as fd:
+            json.dump(cls.to_dict(), fd)
+
+    @classmethod
+    def load(cls, target="./config/profile.config.json"):
+        if not os.path.exists(target):
+            cls.save(target=target)
+            return
+        data: dict
+        with open(target, "r") as fd:
+            data = json.load(fd)
+        cls.allow_header = checktyp(data.get("allow_header"), bool)
+        cls.dump_dir = checktyp(data.get("dump_dir"), str)
+        cls.max_seconds = float(checktyp(data.get("max_seconds"), (int, float)))
+
+
+class UploadConfig:
+    dir: str = "./uploads"  # outside cache/, unfinished uploads are not served
+    max_size: int = 2 * 1024 * 1024 * 1024
+    expire_seconds: float = 86400.0
+
+    @classmethod
+    def to_dict(cls):
+        return {
+            "dir": cls.dir,
+            "max_size": cls.max_size,
+            "expire_seconds": cls.expire_seconds,
+        }
+
+    @classmethod
+    def save(cls, target="./config/upload.config.json"):
+        os.makedirs("config", exist_ok=True)
+        with open(target, "w") as fd:
+            json.dump(cls.to_dict(), fd)
+
+    @classmethod
+    def load(cls, target="./config/upload.config.json"):
+        if not os.path.exists(target):
+            cls.save(target=target)
+            return
+        data: dict
+        with open(target, "r") as fd:
+            data = json.load(fd)
+        cls.dir = checktyp(data.get("dir"), str)
+        cls.max_size = checktyp(data.get("max_size"), int)
+        cls.expire_seconds = float(checktyp(data.get("expire_seconds"), (int, float)))
+
+
+class CacheConfig:
+    keep_builds: int = 0  # per-build copies kept per version, 0 keeps all
+    max_bytes: int = 0  # bound on stored artifacts, 0 is unbounded
+    evict_interval: float = 3600.0
+
+    @classmethod
+    def to_dict(cls):
+        return {
+            "keep_builds": cls.keep_builds,
+            "max_bytes": cls.max_bytes,
+            "evict_interval": cls.evict_interval,
+        }
+
+    @classmethod
+    def save(cls, target="./config/cache.config.json"):
+        os.makedirs("config", exist_ok=True)
+        with open(target, "w") as fd:
+            json.dump(cls.to_dict(), fd)
+
+    @classmethod
+    def load(cls, target="./config/cache.config.json"):
+        if not os.path.exists(target):
+            cls.save(target=target)
+            return
+        data: dict
+        with open(target, "r") as fd:
+            data = json.load(fd)
+        cls.keep_builds = checktyp(data.get("keep_builds"), int)
+        cls.max_bytes = checktyp(data.get("max_bytes"), int)
+        cls.evict_interval = float(checktyp(data.get("evict_interval"), (int, float)))
+        assert cls.keep_builds >= 0 and cls.max_bytes >= 0 and cls.evict_interval > 0
+
+
+class WarmupConfig:
+    groups: int = 2  # newest version groups per project whose build listings are warmed
+    poll_interval: float = 5.0  # how often to check for releases made by other workers
+    refresh_interval: float = 600.0  # rebuild everything at least this often
+
+    @classmethod
+    def to_dict(cls):
+        return {
+            "groups": cls.groups,
+            "poll_interval": cls.poll_interval,
+            "refresh_interval": cls.refresh_interval,
+        }
+
+    @classmethod
+    def save(cls, target="./config/warmup.config.json"):
+        os.makedirs("config", exist_ok=True)
+        with open(target, "w") as fd:
+            json.dump(cls.to_dict(), fd)
+
+    @classmethod
+    def load(cls, target="./config/warmup.config.json"):
+        if not os.path.exists(target):
+            cls.save(target=target)
+            return
+        data: dict
+        with open(target, "r") as fd:
+            data = json.load(fd)
+        cls.groups = checktyp(data.get("groups"), int)
+        cls.poll_interval = float(checktyp(data.get("poll_interval"), (int, float)))
+        cls.refresh_interval = float(
+            checktyp(data.get("refresh_interval"), (int, float))
+        )
+        assert cls.groups >= 0 and cls.poll_interval > 0 and cls.refresh_interval > 0
+
+
+class JournalConfig:
+    path: str = "./journal/releases.ndjson"  # rejected entries go to <path>.rejected
+    batch_size: int = 50
+    interval: float = 1.0  # how often to retry while the DB is unreachable
+    fsync: bool = True
+
+    @classmethod
+    def to_dict(cls):
+        return {
+            "path": cls.path,
+            "batch_size": cls.batch_size,
+            "interval": cls.interval,
+            "fsync": cls.fsync,
+        }
+
+    @classmethod
+    def save(cls, target="./config/journal.config.json"):
+        os.makedirs("config", exist_ok=True)
+        with open(target, "w") as fd:
+            json.dump(cls.to_dict(), fd)
+
+    @classmethod
+    def load(cls, target="./config/journal.config.json"):
+        if not os.path.exists(target):
+            cls.save(target=target)
+            return
+        data: dict
+        with open(target, "r") as fd:
+            data = json.load(fd)
+        cls.path = checktyp(data.get("path"), str)
+        cls.batch_size = checktyp(data.get("batch_size"), int)
+        cls.interval = float(checktyp(data.get("interval"), (int, float)))
+        cls.fsync = checktyp(data.get("fsync"), bool)
+        assert cls.batch_size > 0 and cls.interval > 0
+
+
+class StatsConfig:
+    enabled: bool = True
+    flush_interval: float = 30.0  # how far the stored counts may lag behind
+
+    @classmethod
+    def to_dict(cls):
+        return {
+            "enabled": cls.enabled,
+            "flush_interval": cls.flush_interval,
+        }
+
+    @classmethod
+    def save(cls, target="./config/stats.config.json"):
+        os.makedirs("config", exist_ok=True)
+        with open(target, "w") as fd:
+            json.dump(cls.to_dict(), fd)
+
+    @classmethod
+    def load(cls, target="./config/stats.config.json"):
+        if not os.path.exists(target):
+            cls.save(target=target)
+            return
+        data: dict
+        with open(target, "r") as fd:
+            data = json.load(fd)
+        cls.enabled = checktyp(data.get("enabled"), bool)
+        cls.flush_interval = float(checktyp(data.get("flush_interval"), (int, float)))
+        assert cls.flush_interval > 0
@@ -0,0 +1,38 @@
+from typing import Dict, Tuple
+
+from release_index import DownloadRecord
+
+# (project_id, version, build, type)
+StatsKey = Tuple[str, str, int, str]
+
+
+class DownloadCounter:
+    """Downloads served by this worker that are not in the DB yet.
+
+    Only the event loop touches it, so counting is a dict update with no lock;
+    ``drain`` hands the counts to the flush by swapping in a fresh dict. Counts
+    are keyed by the download record itself and only turned into DB keys when
+    drained, keeping the per-request cost to one hash lookup.
+    """
+
+    def __init__(self):
+        self.counts: Dict[DownloadRecord, int] = {}
+        self._unsaved: Dict[StatsKey, int] = {}
+
+    def hit(self, download: DownloadRecord):
+        counts = self.counts
+        counts[download] = counts.get(download, 0) + 1
+
+    def drain(self) -> Dict[StatsKey, int]:
+        counts, self.counts = self.counts, {}
+        rows, self._unsaved = self._unsaved, {}
+        for download, count in counts.items():
+            record = download.build_record
+            key = (record.project_id, record.version, record.build, download.type)
+            rows[key] = rows.get(key, 0) + count
+        return rows
+
+    def restore(self, rows: Dict[StatsKey, int]):
+        """Keep counts whose flush failed for the next one."""
+        for key, count in rows.items():
+            self._unsaved[key] = self._unsaved.get(key, 0) + count
@@ -0,0 +1,112 @@
+import fcntl
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterable, List
+
+
+class JournalEntry:
+    __slots__ = ("id", "received", "release")
+
+    def __init__(self, id: str, received: float, release: dict):
+        self.id = id
+        self.received = received
+        self.release = release
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "received": self.received, "release": self.release}
+
+
+def entry_id(release: dict) -> str:
+    # the same payload sent twice, e.g. by a retrying CI job, is one entry
+    canonical = json.dumps(release, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+
+class ReleaseJournal:
+    """Append-only NDJSON file of accepted releases that are not yet in the DB.
+
+    ``append`` returns once the entry is on disk. Entries leave the file through
+    ``remove`` after they were applied. A lock file serializes the two across
+    workers; a torn last line from a crash mid-write is skipped when reading.
+    """
+
+    def __init__(self, path: str, fsync: bool = True):
+        self.path = path
+        self.fsync = fsync
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        with open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def append(self, release: dict) -> JournalEntry:
+        entry = JournalEntry(entry_id(release), time.time(), release)
+        self.append_entry(entry)
+        return entry
+
+    def append_entry(self, entry: JournalEntry):
+        line = json.dumps(entry.to_dict(), ensure_ascii=False) + "\n"
+        with self._locked(), open(self.path, "a", encoding="utf-8") as fd:
+            fd.write(line)
+            fd.flush()
+            if self.fsync:
+                os.fsync(fd.fileno())
+
+    def _read(self) -> List[JournalEntry]:
+        entries, seen = [], set()
+        try:
+            fd = open(self.path, "r", encoding="utf-8")
+        except FileNotFoundError:
+            return entries
+        with fd:
+            for line in fd:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    continue
+                if item["id"] not in seen:
+                    seen.add(item["id"])
+                    entries.append(
+                        JournalEntry(item["id"], item["received"], item["release"])
+                    )
+        return entries
+
+    def pending(self) -> List[JournalEntry]:
+        """Entries in the order they were accepted, each once."""
+        with self._locked():
+            return self._read()
+
+    def remove(self, ids: Iterable[str]):
+        ids = set(ids)
+        if not ids:
+            return
+        with self._locked():
+            keep = [entry for entry in self._read() if entry.id not in ids]
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as fd:
+                for entry in keep:
+                    fd.write(json.dumps(entry.to_dict(), ensure_ascii=False) + "\n")
+                fd.flush()
+                if self.fsync:
+                    os.fsync(fd.fileno())
+            os.replace(tmp, self.path)
+
+    def reject(self, entry: JournalEntry):
+        """Set aside an entry that can not be applied, for a later replay."""
+        ReleaseJournal(self.path + ".rejected", self.fsync).append_entry(entry)
+
+    @contextmanager
+    def applier(self):
+        """Yield True in the one process that may apply entries right now."""
+        with open(self.path + ".apply.lock", "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            yield True
@@ -1,26 +1,79 @@
-from fastapi import FastAPI, UploadFile, Form, File
+from fastapi import (
+    FastAPI,
+    UploadFile,
+    Form,
+    File,
+    Request,
+    Header,
+)
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.docs import (
     get_swagger_ui_html,
     get_swagger_ui_oauth2_redirect_html,
 )
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import RedirectResponse, Response
+from fastapi.responses import RedirectResponse, Response, JSONResponse, FileResponse
 from fastapi.exceptions import HTTPException
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 import uvicorn
+import asyncio
 import functools
+import math
 import sqlalchemy
 import os
 import hashlib
-from sqlalchemy import create_engine, func, desc
-from sqlalchemy.dialects.mysql import Insert as insert
+import time
+from datetime import datetime
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.dialects.mysql import Insert as insert, match
 from sqlalchemy.orm import Session
+from typing import Dict, List, Optional, Union
 from ucloud.core import exc
 from ucloud.client import Client
 
 from sql_tables import *
-from config import MysqlConfig, WebConfig, CDNConfig
+from config import (
+    MysqlConfig,
+    WebConfig,
+    CDNConfig,
+    RateLimitConfig,
+    MirrorConfig,
+    LogConfig,
+    ProfileConfig,
+    UploadConfig,
+    CacheConfig,
+    WarmupConfig,
+    JournalConfig,
+    StatsConfig,
+)
+from journal import JournalEntry, ReleaseJournal
+from download_stats import DownloadCounter
+from ratelimit import TokenBucketLimiter
+from singleflight import coalesce
+from release_index import BuildRecord, CommitRecord, DownloadRecord, ReleaseIndex
+from changelog import parse_changes
+from access_log import AccessLog, begin_request, end_request, log_event, span
+from profiling import (
+    ProfileController,
+    ProfileMiddleware,
+    ProfilerBusy,
+    SamplingProfiler,
+    dump_profile,
+)
+from mirror import ChecksumMismatch, HttpFetcher, LocalFetcher, mirror_artifact
+from artifact_store import (
+    CacheStaticFiles,
+    adopt_legacy,
+    build_path,
+    evict,
+    has_object,
+    link_build,
+    publish_alias,
+    put_object,
+    temp_file,
+)
+from uploads import UploadError, UploadSession, UploadStore, valid_filename
 
 
 CDN_URL = "https://cdn.leavesmc.z0z0r4.top"
@@ -33,6 +86,23 @@ def sql_replace(sess: Session, table, **kwargs):
     sess.execute(on_duplicate_key_stmt)
 
 
+def sql_replace_many(sess: Session, table, rows: List[dict]):
+    # one multi-row statement instead of a round trip per row
+    if not rows:
+        return
+    insert_stmt = insert(table).values(rows)
+    on_duplicate_key_stmt = insert_stmt.on_duplicate_key_update(
+        {key: insert_stmt.inserted[key] for key in rows[0]}
+    )
+    sess.execute(on_duplicate_key_stmt)
+
+
+def begin(sess: Session):
+    # the engine URL sets autocommit=1, so without this each statement commits
+    # on its own and a multi-statement write is not atomic
+    sess.execute(text("START TRANSACTION"))
+
+
 app = FastAPI(description="LeavesMC website API", version="0.1.0", title="LeavesMC")
 
 app.add_middleware(
@@ -43,12 +113,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+profile_controller = ProfileController()
+app.add_middleware(ProfileMiddleware, controller=profile_controller)
+
 # docs
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # cdn_download_file
 os.makedirs("cache", exist_ok=True)
-app.mount("/cache", StaticFiles(directory="cache"), name="cache")
+app.mount("/cache", CacheStaticFiles(directory="cache"), name="cache")
 
 
 @app.get("/favicon.ico", include_in_schema=False)
@@ -75,21 +148,134 @@ async def swagger_ui_redirect():
 def api_json_middleware(callback):
     @functools.wraps(callback)
     async def w(*args, **kwargs):
+        if not app.state.ready:
+            # an empty index would answer 404 for everything
+            raise HTTPException(status_code=503, detail="release index not loaded")
         try:
             res = await callback(*args, **kwargs)
             return res
         except sqlalchemy.exc.OperationalError:
-            await _startup()
+            # drop pooled connections the server closed and retry once
+            await run_in_threadpool(app.state.sql_engine.dispose)
             res = await callback(*args, **kwargs)
             return res
 
     return w
 
 
-@app.on_event("startup")
-async def _startup():
+def rendered(index: ReleaseIndex, key: tuple) -> bytes:
+    return index.rendered(key, functools.partial(RENDERERS[key[0]], index, *key[1:]))
+
+
+def cached_response(index: ReleaseIndex, *key) -> Response:
+    with span("serialize"):
+        body = rendered(index, key)
+    return Response(content=body, media_type="application/json")
+
+
+def download_url(download: DownloadRecord) -> str:
+    # prefer the verified copy on our CDN over GitHub's redirect chain
+    if download.mirror_path is not None:
+        return CDN_URL + "/cache/" + download.mirror_path
+    return download.url
+
+
+def build_info(record: BuildRecord, cdn_url: bool = False) -> dict:
+    downloads = {}
+    for type, download in record.downloads.items():
+        downloads[type] = download.to_dict()
+        if cdn_url:
+            downloads[type]["cdn_url"] = (
+                CDN_URL + "/cache/" + (download.mirror_path or download.name)
+            )
+    return {
+        "project_id": record.project_id,
+        "project_name": record.project_id,
+        "version": record.version,
+        "build": record.build,
+        "time": record.time,
+        "channel": record.channel,
+        "promoted": record.promoted,
+        "changes": [commit.to_dict() for commit in record.changes],
+        "downloads": downloads,
+    }
+
+
+# bodies of the cached routes, by the first element of their cache key; every
+# other element is an argument
+
+
+def render_projects(index: ReleaseIndex) -> dict:
+    return {"projects": list(index.projects)}
+
+
+def render_project(index: ReleaseIndex, project: str) -> dict:
+    return index.projects[project].to_dict()
+
+
+def render_version(index: ReleaseIndex, project: str, version: str) -> dict:
+    return {
+        "project_id": project,
+        "project_name": project,
+        "version": version,
+        "builds": [record.build for record in index.by_version[(project, version)]],
+    }
+
+
+def render_version_builds(index: ReleaseIndex, project: str, version: str) -> dict:
+    return {
+        "project_id": project,
+        "project_name": project,
+        "version": version,
+        "builds": [record.to_dict() for record in index.by_version[(project, version)]],
+    }
+
+
+def render_latest(index: ReleaseIndex, project: str, version: str) -> dict:
+    return build_info(index.latest(project, version), cdn_url=True)
+
+
+def render_build(index: ReleaseIndex, project: str, version: str, build: int) -> dict:
+    return build_info(index.build(project, version, build))
+
+
+def render_version_group(index: ReleaseIndex, project: str, version_group: str) -> dict:
+    return {
+        "project_id": project,
+        "project_name": index.by_group[(project, version_group)][0].project_name,
+        "version_group": version_group,
+        "versions": index.versions_in_group(project, version_group),
+    }
+
+
+def render_version_group_builds(
+    index: ReleaseIndex, project: str, version_group: str
+) -> dict:
+    return {
+        "project_id": project,
+        "project_name": project,
+        "version_group": version_group,
+        "builds": [
+            record.to_dict() for record in index.by_group[(project, version_group)]
+        ],
+    }
+
+
+RENDERERS = {
+    "projects": render_projects,
+    "project": render_project,
+    "version": render_version,
+    "version_builds": render_version_builds,
+    "latest": render_latest,
+    "build": render_build,
+    "version_group": render_version_group,
+    "version_group_builds": render_version_group_builds,
+}
+
+
+def make_engine():
     MysqlConfig.load()
-    app.state.sql_engine = create_engine(
+    return create_engine(
         f"mysql+pymysql://{MysqlConfig.user}:{MysqlConfig.password}@{MysqlConfig.host}:{MysqlConfig.port}/{MysqlConfig.database}?autocommit=1",
         pool_size=128,
         max_overflow=32,
@@ -98,6 +284,386 @@ async def _startup():
     )
 
 
+@app.on_event("startup")
+async def _startup():
+    app.state.sql_engine = make_engine()
+
+
+@coalesce
+def load_release_index() -> ReleaseIndex:
+    with Session(bind=app.state.sql_engine) as sess:
+        # read first, so a release committed meanwhile counts as newer
+        generation = current_generation(sess)
+        with span("sql.project_info"):
+            project_rows = sess.execute(Project.__table__.select()).all()
+        with span("sql.file_info"):
+            file_rows = sess.execute(File.__table__.select()).all()
+        with span("sql.commit_info"):
+            commit_rows = sess.execute(
+                select(
+                    BuildCommit.project_id,
+                    BuildCommit.version,
+                    BuildCommit.build,
+                    Commit.hash,
+                    Commit.summary,
+                    Commit.message,
+                )
+                .join(Commit, Commit.hash == BuildCommit.hash)
+                .order_by(BuildCommit.position)
+            ).all()
+        with span("sql.project_registry"):
+            registry_rows = sess.execute(ProjectRegistry.__table__.select()).all()
+    with span("index"):
+        index = ReleaseIndex.from_rows(
+            project_rows, file_rows, commit_rows, registry_rows
+        )
+        index.generation = generation
+    for sha256, downloads in index.by_sha256.items():
+        for download in downloads:
+            adopt_legacy(sha256, download.name)
+            record = download.build_record
+            path = build_path(
+                record.project_id, record.version, record.build, download.name
+            )
+            if os.path.isfile(os.path.join("cache", path)) or has_object(sha256):
+                download.mirror_path = link_download(download)
+
+    # bring registry rows in line with the builds, e.g. on first start
+    stored = {row.project_id: dict(row._mapping) for row in registry_rows}
+    with Session(bind=app.state.sql_engine) as sess, span("sql"):
+        for project in index.projects.values():
+            row = project.to_dict()
+            if stored.get(project.project_id) != row:
+                sql_replace(sess, ProjectRegistry, **row)
+        sess.commit()
+    return index
+
+
+def current_generation(sess: Session) -> int:
+    return sess.execute(select(ReleaseGeneration.generation)).scalar() or 0
+
+
+def hot_keys(index: ReleaseIndex, groups: int) -> List[tuple]:
+    """Cache keys of what launchers fetch most: projects, latest builds and the
+    build listings of each project's ``groups`` newest version groups."""
+    keys = [("projects",)]
+    for project in list(index.projects.values()):
+        project_id = project.project_id
+        keys.append(("project", project_id))
+        for version in list(project.versions):
+            keys.append(("version", project_id, version))
+            keys.append(("latest", project_id, version))
+        newest = sorted(project.version_groups, key=project.version_groups.get)
+        for version_group in newest[-groups:] if groups else []:
+            keys.append(("version_group", project_id, version_group))
+            keys.append(("version_group_builds", project_id, version_group))
+            for version in index.versions_in_group(project_id, version_group):
+                keys.append(("version_builds", project_id, version))
+    return keys
+
+
+def warm_up(index: ReleaseIndex):
+    for key in hot_keys(index, WarmupConfig.groups):
+        rendered(index, key)
+
+
+async def refresh_release_index():
+    """Load the index and render its hot responses before any request can see it."""
+    index = await load_release_index()
+    await run_in_threadpool(warm_up, index)
+    app.state.release_index = index
+    app.state.ready = True
+    app.state.synced = time.monotonic()
+
+
+async def load_first_index():
+    await run_in_threadpool(Base.metadata.create_all, app.state.sql_engine)
+    await refresh_release_index()
+
+
+@app.on_event("startup")
+async def _load_release_index():
+    WarmupConfig.load()
+    # empty until the first load, the index routes answer 503 meanwhile
+    app.state.release_index = ReleaseIndex()
+    app.state.ready = False
+    try:
+        await load_first_index()
+    except Exception as e:
+        # most likely MySQL is down; start anyway so releases are still
+        # journaled, the refresh task retries the load
+        log_event("index_load_failed", error=str(e))
+    app.state.refresh_task = asyncio.create_task(refresh_hot_responses())
+
+
+@app.on_event("shutdown")
+async def _stop_refresh():
+    app.state.refresh_task.cancel()
+
+
+def read_generation() -> int:
+    with Session(bind=app.state.sql_engine) as sess:
+        return current_generation(sess)
+
+
+async def refresh_hot_responses():
+    reloaded = time.monotonic()
+    while True:
+        await asyncio.sleep(WarmupConfig.poll_interval)
+        try:
+            if not app.state.ready:
+                await load_first_index()
+                reloaded = time.monotonic()
+                continue
+            generation = await run_in_threadpool(read_generation)
+            app.state.synced = time.monotonic()
+            index = app.state.release_index
+            if (
+                generation != index.generation
+                or time.monotonic() - reloaded >= WarmupConfig.refresh_interval
+            ):
+                # another worker published, or it is time for a full rebuild
+                await refresh_release_index()
+                reloaded = time.monotonic()
+                continue
+            # re-render what invalidate() dropped, e.g. after a mirror finished
+            for key in hot_keys(index, WarmupConfig.groups):
+                rendered(index, key)
+                await asyncio.sleep(0)
+        except Exception as e:
+            # the DB being down, or a link failing in the new index; keep polling
+            log_event("index_refresh_failed", error=str(e))
+
+
+@app.get("/ready", include_in_schema=False)
+async def ready():
+    """503 until the first index load succeeded; afterwards the index can serve
+    even while the DB is down, ``synced`` tells how stale it may be."""
+    if not app.state.ready:
+        return JSONResponse({"ready": False}, status_code=503)
+    index = app.state.release_index
+    return {
+        "ready": True,
+        "generation": index.generation,
+        "builds": len(index.builds),
+        "synced": round(time.monotonic() - app.state.synced, 3),
+    }
+
+
+@app.on_event("startup")
+async def _setup_mirror():
+    MirrorConfig.load()
+
+
+def artifact_fetcher():
+    if MirrorConfig.fetcher == "local":
+        return LocalFetcher(MirrorConfig.local_root)
+    return HttpFetcher(MirrorConfig.timeout)
+
+
+def link_download(download: DownloadRecord) -> str:
+    record = download.build_record
+    return link_build(
+        download.sha256, record.project_id, record.version, record.build, download.name
+    )
+
+
+async def mirror_downloads(downloads: List[DownloadRecord]):
+    fetcher = artifact_fetcher()
+    for download in downloads:
+        try:
+            await run_in_threadpool(
+                mirror_artifact, fetcher, download.url, download.sha256, download.name
+            )
+            download.mirror_path = await run_in_threadpool(link_download, download)
+        except (ChecksumMismatch, OSError) as e:
+            log_event("mirror_failed", url=download.url, error=str(e))
+    app.state.release_index.invalidate()
+
+
+@app.on_event("startup")
+async def _start_cache_eviction():
+    CacheConfig.load()
+    app.state.eviction_task = asyncio.create_task(cache_eviction())
+
+
+@app.on_event("shutdown")
+async def _stop_cache_eviction():
+    app.state.eviction_task.cancel()
+
+
+def missing_copies(mirrored):
+    return [
+        download
+        for download, path in mirrored
+        if not os.path.isfile(os.path.join("cache", path))
+    ]
+
+
+async def cache_eviction():
+    while True:
+        await asyncio.sleep(CacheConfig.evict_interval)
+        index = app.state.release_index
+        keep, links, mirrored = {}, {}, []
+        if CacheConfig.keep_builds:
+            for key, builds in index.by_version.items():
+                keep[key] = {r.build for r in builds[-CacheConfig.keep_builds :]}
+        for sha256, downloads in index.by_sha256.items():
+            for download in downloads:
+                if download.mirror_path is not None:
+                    links.setdefault(sha256, []).append(download.mirror_path)
+                    mirrored.append((download, download.mirror_path))
+        try:
+            await run_in_threadpool(evict, keep, links, CacheConfig.max_bytes)
+            # also catches copies another worker evicted
+            gone = await run_in_threadpool(missing_copies, mirrored)
+        except OSError as e:
+            log_event("cache_eviction_failed", error=str(e))
+            continue
+        for download in gone:
+            download.mirror_path = None
+        if gone:
+            index.invalidate()
+
+
+@app.on_event("startup")
+async def _setup_rate_limit():
+    RateLimitConfig.load()
+    app.state.rate_limiter = (
+        TokenBucketLimiter(
+            RateLimitConfig.rate, RateLimitConfig.burst, RateLimitConfig.max_clients
+        )
+        if RateLimitConfig.enabled
+        else None
+    )
+
+
+def client_ip(scope) -> str:
+    if RateLimitConfig.trust_forwarded:
+        headers = dict(scope["headers"])
+        real_ip = headers.get(b"x-real-ip")
+        if real_ip:
+            return real_ip.decode("latin-1").strip()
+        # earlier entries come from the client, only the last is our proxy's
+        forwarded = headers.get(b"x-forwarded-for")
+        if forwarded:
+            return forwarded.decode("latin-1").rsplit(",", 1)[-1].strip()
+    client = scope.get("client")
+    return client[0] if client else ""
+
+
+class RateLimitMiddleware:
+    """Answers 429 to clients over their budget for GET /projects*.
+
+    Plain ASGI, so with rate limiting disabled a request only costs one check.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            limiter = app.state.rate_limiter
+            if (
+                limiter is not None
+                and scope["method"] == "GET"
+                and scope["path"].startswith("/projects")
+            ):
+                retry_after = limiter.acquire(client_ip(scope))
+                if retry_after:
+                    response = JSONResponse(
+                        {"detail": "Too Many Requests"},
+                        status_code=429,
+                        headers={"Retry-After": str(math.ceil(retry_after))},
+                    )
+                    return await response(scope, receive, send)
+        await self.app(scope, receive, send)
+
+
+app.add_middleware(RateLimitMiddleware)
+
+
+@app.on_event("startup")
+async def _setup_access_log():
+    LogConfig.load()
+    app.state.access_log = None
+    if LogConfig.enabled:
+        app.state.access_log = AccessLog(
+            LogConfig.path, LogConfig.sample_rate, LogConfig.slow_ms
+        )
+        app.state.access_log.start()
+
+
+@app.on_event("shutdown")
+async def _stop_access_log():
+    if app.state.access_log is not None:
+        app.state.access_log.stop()
+
+
+@functools.lru_cache(maxsize=None)
+def route_template(endpoint) -> str:
+    for route in app.routes:
+        if getattr(route, "endpoint", None) is endpoint:
+            return route.path
+    return ""
+
+
+class AccessLogMiddleware:
+    """Logs each request with its route, status, duration and timing spans.
+
+    Plain ASGI like ``ProfileMiddleware``; the duration covers sending the body.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or app.state.access_log is None:
+            return await self.app(scope, receive, send)
+        access_log = app.state.access_log
+        spans, token = begin_request()
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            end_request(token)
+            if access_log.sampled(status, duration):
+                endpoint = scope.get("endpoint")
+                access_log.log(
+                    {
+                        "time": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                        "client": client_ip(scope),
+                        "method": scope["method"],
+                        "path": scope["path"],
+                        "route": route_template(endpoint) if endpoint else None,
+                        "path_params": scope.get("path_params", {}),
+                        "status": status,
+                        "duration_ms": round(duration, 3),
+                        "spans": {name: round(ms, 3) for name, ms in spans.items()},
+                    }
+                )
+
+
+# outermost, so it also times the rate limit and profiling layers
+app.add_middleware(AccessLogMiddleware)
+
+
+@app.on_event("startup")
+async def _setup_profiling():
+    ProfileConfig.load()
+    profile_controller.dump_dir = ProfileConfig.dump_dir
+    profile_controller.header_secret = SECRET if ProfileConfig.allow_header else None
+
+
 @app.get("/", description="Root")
 @api_json_middleware
 async def root():
@@ -115,9 +681,8 @@ async def root():
 )
 @api_json_middleware
 async def projects():
-    with Session(bind=app.state.sql_engine) as sess:
-        project_id_list = sess.query(Project.project_id).distinct().all()
-    return {"projects": [project for project in project_id_list[0]]}
+    index = app.state.release_index
+    return cached_response(index, "projects")
 
 
 @app.get(
@@ -140,6 +705,8 @@ async def projects():
                             "1.20",
                             "1.20.1",
                         ],
+                        "latest_version": "1.20.1",
+                        "latest_build": 42,
                     }
                 }
             },
@@ -148,29 +715,11 @@ async def projects():
 )
 @api_json_middleware
 async def project_info(project: str = "leaves"):
-    with Session(bind=app.state.sql_engine) as sess:
-        result = (
-            sess.query(Project.project_name, Project.version, Project.version_group)
-            .where(Project.project_id == project)
-            .distinct()
-            .all()
-        )
-        if result == ():
-            raise HTTPException(status_code=404, detail=f"{project} not found")
-
-        project_info = {
-            "project_id": project,
-            "project_name": result[0]["project_name"],
-            "version_groups": [],
-            "versions": [],
-        }
-        for res in result:
-            if res[1] not in project_info["versions"]:
-                project_info["versions"].append(res[1])
-            if res[2] not in project_info["version_groups"]:
-                project_info["version_groups"].append(res[2])
-
-        return project_info
+    index = app.state.release_index
+    record = index.projects.get(project)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"{project} not found")
+    return cached_response(index, "project", project)
 
 
 @app.get(
@@ -193,20 +742,11 @@ async def project_info(project: str = "leaves"):
 )
 @api_json_middleware
 async def project_version_info(project: str = "leaves", version: str = "1.20.1"):
-    with Session(bind=app.state.sql_engine) as sess:
-        result = (
-            sess.query(Project.build)
-            .filter(Project.project_id == project, Project.version == version)
-            .all()
-        )
-    if len(result) == 0:
+    index = app.state.release_index
+    builds = index.by_version.get((project, version))
+    if not builds:
         raise HTTPException(status_code=404, detail=f"{project} or {version} not found")
-    return {
-        "project_id": project,
-        "project_name": project,
-        "version": version,
-        "builds": [build[0] for build in result if result != ()],
-    }
+    return cached_response(index, "version", project, version)
 
 
 @app.get(
@@ -250,71 +790,11 @@ async def project_version_info(project: str = "leaves", version: str = "1.20.1")
 )
 @api_json_middleware
 async def project_version_builds_info(project: str = "leaves", version: str = "1.20.1"):
-    with Session(bind=app.state.sql_engine) as sess:
-        build_result = (
-            sess.query(Project)
-            .filter(Project.project_id == project, Project.version == version)
-            .all()
-        )
-        if len(build_result) == 0:
-            raise HTTPException(
-                status_code=404, detail=f"{project} or {version} not found"
-            )
-        download_result = (
-            sess.query(File)
-            .filter(File.project_id == project, File.version == version)
-            .all()
-        )
-        download_info_by_build = {}
-        for download_info in download_result:
-            if download_info_by_build.get(download_info.build) is None:  # 3 is build
-                download_info_by_build[download_info.build] = {}
-            download_info_by_build[download_info.build][download_info.type] = {
-                "name": download_info.name,
-                "sha256": download_info.sha256,
-                "url": download_info.url,
-            }
-
-        change_result = (
-            sess.query(Commit)
-            .filter(Commit.project_id == project, Commit.version == version)
-            .all()
-        )
-        commit_info_by_build = {}
-        for commit_info in change_result:
-            if commit_info_by_build.get(commit_info.build) is None:  # 3 is build
-                commit_info_by_build[commit_info.build] = []
-            commit_info_by_build[commit_info.build].append(
-                {
-                    "commit": commit_info.hash,
-                    "summary": commit_info.summary,
-                    "message": commit_info.message,
-                }
-            )
-
-        builds = []
-        for build in build_result:
-            builds.append(
-                {
-                    "build": build.build,
-                    "time": build.time.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
-                    "channel": build.channel,
-                    "promoted": build.promoted,
-                    "changes": commit_info_by_build[build.build]
-                    if build.build in commit_info_by_build
-                    else [],
-                    "downloads": download_info_by_build[build.build]
-                    if build.build in download_info_by_build
-                    else [],
-                }
-            )
-
-        return {
-            "project_id": project,
-            "project_name": project,
-            "version": version,
-            "builds": builds,
-        }
+    index = app.state.release_index
+    builds = index.by_version.get((project, version))
+    if not builds:
+        raise HTTPException(status_code=404, detail=f"{project} or {version} not found")
+    return cached_response(index, "version_builds", project, version)
 
 
 @app.get(
@@ -363,70 +843,13 @@ async def project_version_builds_info(project: str = "leaves", version: str = "1
         }
     },
 )
+@api_json_middleware
 async def latest_build_info(project: str = "leaves", version: str = "1.20.1"):
-    with Session(bind=app.state.sql_engine) as sess:
-        build_result = (
-            sess.query(Project)
-            .filter(
-                Project.project_id == project,
-                Project.version == version,
-            )
-            .order_by(desc(Project.build))
-            .limit(1)
-            .one_or_none()
-        )
-        if build_result == None:
-            raise HTTPException(
-                status_code=404, detail=f"{project} or {version} not found"
-            )
-        build = build_result.build
-        download_result = (
-            sess.query(File)
-            .filter(
-                File.project_id == project,
-                File.version == version,
-                File.build == build,
-            )
-            .all()
-        )
-        downloads_info = {}
-        for download_info in download_result:
-            downloads_info[download_info.type] = {
-                "name": download_info.name,
-                "sha256": download_info.sha256,
-                "url": download_info.url,
-                "cdn_url": CDN_URL + "/cache/" + download_info.name,
-            }
-
-        change_result = (
-            sess.query(Commit)
-            .filter(
-                Commit.project_id == project,
-                Commit.version == version,
-                Commit.build == build,
-            )
-            .all()
-        )
-        changes_info = [
-            {
-                "commit": commit_info.hash,
-                "summary": commit_info.summary,
-                "message": commit_info.message,
-            }
-            for commit_info in change_result
-        ]
-
-        return {
-            "project_id": project,
-            "project_name": project,
-            "version": version,
-            "build": build_result.build,
-            "time": build_result.time.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
-            "channel": build_result.channel,
-            "promoted": build_result.promoted,
-            "changes": changes_info,
-            "downloads": downloads_info,
-        }
+    index = app.state.release_index
+    record = index.latest(project, version)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"{project} or {version} not found")
+    return cached_response(index, "latest", project, version)
 
 
 @app.get(
@@ -479,66 +902,11 @@ async def latest_build_info(project: str = "leaves", version: str = "1.20.1"):
 async def project_version_build_info(
     build: int, project: str = "leaves", version: str = "1.20.1"
 ):
-    with Session(bind=app.state.sql_engine) as sess:
-        build_result = (
-            sess.query(Project)
-            .filter(
-                Project.project_id == project,
-                Project.version == version,
-                Project.build == build,
-            )
-            .one_or_none()
-        )
-        if build_result == None:
-            raise HTTPException(
-                status_code=404, detail=f"{project} or {version} not found"
-            )
-        download_result = (
-            sess.query(File)
-            .filter(
-                File.project_id == project,
-                File.version == version,
-                File.build == build,
-            )
-            .all()
-        )
-        downloads_info = {}
-        for download_info in download_result:
-            downloads_info[download_info.type] = {
-                "name": download_info.name,
-                "sha256": download_info.sha256,
-                "url": download_info.url,
-            }
-
-        change_result = (
-            sess.query(Commit)
-            .filter(
-                Commit.project_id == project,
-                Commit.version == version,
-                Commit.build == build,
-            )
-            .all()
-        )
-        changes_info = [
-            {
-                "commit": commit_info.hash,
-                "summary": commit_info.summary,
-                "message": commit_info.message,
-            }
-            for commit_info in change_result
-        ]
-
-        return {
-            "project_id": project,
-            "project_name": project,
-            "version": version,
-            "build": build_result.build,
-            "time": build_result.time.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
-            "channel": build_result.channel,
-            "promoted": build_result.promoted,
-            "changes": changes_info,
-            "downloads": downloads_info,
-        }
+    index = app.state.release_index
+    record = index.build(project, version, build)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"{project} or {version} not found")
+    return cached_response(index, "build", project, version, build)
 
 
 @app.get(
@@ -561,25 +929,13 @@ async def project_version_build_info(
 )
 @api_json_middleware
 async def version_group_info(project: str = "leaves", version_group: str = "1.20"):
-    with Session(bind=app.state.sql_engine) as sess:
-        result = (
-            sess.query(Project.version, Project.project_name)
-            .where(Project.version_group == version_group)
-            .distinct()
-            .all()
+    index = app.state.release_index
+    builds = index.by_group.get((project, version_group))
+    if not builds:
+        raise HTTPException(
+            status_code=404, detail=f"{project} or {version_group} not found"
         )
-        if len(result) == 0:
-            raise HTTPException(
-                status_code=404, detail=f"{project} or {version_group} not found"
-            )
-        if result == None:
-            return {"error": "Version not found."}
-        return {
-            "project_id": project,
-            "project_name": result[0][1],
-            "version_group": version_group,
-            "versions": [res[0] for res in result],
-        }
+    return cached_response(index, "version_group", project, version_group)
 
 
 @app.get(
@@ -619,96 +975,241 @@ async def version_group_info(project: str = "leaves", version_group: str = "1.20
 async def version_group_builds_info(
     project: str = "leaves", version_group: str = "1.20"
 ):
+    index = app.state.release_index
+    builds = index.by_group.get((project, version_group))
+    if not builds:
+        raise HTTPException(
+            status_code=404, detail=f"{project} or {version_group} not found"
+        )
+    return cached_response(index, "version_group_builds", project, version_group)
+
+
+def changes_between(project: str, version_group: str, from_build: int, to_build: int):
     with Session(bind=app.state.sql_engine) as sess:
-        build_result = (
-            sess.query(Project)
-            .filter(
-                Project.project_id == project, Project.version_group == version_group
-            )
-            .all()
+        return sess.execute(
+            select(BuildCommit.build, Commit.hash, Commit.summary, Commit.message)
+            .join(Commit, Commit.hash == BuildCommit.hash)
+            .where(BuildCommit.project_id == project)
+            .where(BuildCommit.version_group == version_group)
+            .where(BuildCommit.build > from_build)
+            .where(BuildCommit.build <= to_build)
+            .order_by(BuildCommit.build.desc(), BuildCommit.position)
+        ).all()
+
+
+@app.get(
+    "/projects/{project}/version_group/{version_group}/changes",
+    description="get the changes after build from_build up to and including to_build",
+    responses={
+        200: {
+            "content": {
+                "application/json": {
+                    "example": {
+                        "project_id": "leaves",
+                        "version_group": "1.20",
+                        "from_build": 1,
+                        "to_build": 3,
+                        "changes": [
+                            {
+                                "build": 3,
+                                "commit": "1fbd58437c9c9d4e8b3e1a5f9b1c7d0e2a4b6c8d",
+                                "summary": "Fix sync",
+                                "message": "Fix sync",
+                            }
+                        ],
+                    }
+                }
+            },
+        }
+    },
+)
+@api_json_middleware
+async def version_group_changes(
+    from_build: int,
+    to_build: int,
+    project: str = "leaves",
+    version_group: str = "1.20",
+):
+    if not app.state.release_index.by_group.get((project, version_group)):
+        raise HTTPException(
+            status_code=404, detail=f"{project} or {version_group} not found"
         )
-        if len(build_result) == 0:
-            raise HTTPException(
-                status_code=404, detail=f"{project} or {version_group} not found"
-            )
-        download_result = (
-            sess.query(File)
-            .filter(File.project_id == project, File.version_group == version_group)
-            .all()
+    if from_build >= to_build:
+        raise HTTPException(
+            status_code=400, detail="from_build must be lower than to_build"
         )
-        download_info_by_build = {}
-        for download_info in download_result:
-            if download_info_by_build.get(download_info.build) is None:  # 3 is build
-                download_info_by_build[download_info.build] = {}
-            download_info_by_build[download_info.build][download_info.type] = {
-                "name": download_info.name,
-                "sha256": download_info.sha256,
-                "url": download_info.url,
-            }
-
-        change_result = (
-            sess.query(Commit)
-            .filter(Commit.project_id == project, Commit.version_group == version_group)
-            .all()
+    with span("sql"):
+        rows = await run_in_threadpool(
+            changes_between, project, version_group, from_build, to_build
         )
-        commit_info_by_build = {}
-        for commit_info in change_result:
-            if commit_info_by_build.get(commit_info.build) is None:  # 3 is build
-                commit_info_by_build[commit_info.build] = []
-            commit_info_by_build[commit_info.build].append(
+    # a commit listed by several builds in the range shows once, at the newest
+    changes, seen = [], set()
+    for row in rows:
+        if row.hash not in seen:
+            seen.add(row.hash)
+            changes.append(
                 {
-                    "commit": commit_info.hash,
-                    "summary": commit_info.summary,
-                    "message": commit_info.message,
+                    "build": row.build,
+                    "commit": row.hash,
+                    "summary": row.summary,
+                    "message": row.message,
                 }
             )
+    return {
+        "project_id": project,
+        "version_group": version_group,
+        "from_build": from_build,
+        "to_build": to_build,
+        "changes": changes,
+    }
+
+
+SEARCH_MAX_LIMIT = 100
 
-        builds = []
-        for build in build_result:
-            builds.append(
-                {
-                    "build": build.build,
-                    "time": build.time.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
-                    "channel": build.channel,
-                    "promoted": build.promoted,
-                    "changes": commit_info_by_build[build.build]
-                    if build.build in commit_info_by_build
-                    else [],
-                    "downloads": download_info_by_build[build.build]
-                    if build.build in download_info_by_build
-                    else [],
-                }
-            )
 
-        return {
-            "project_id": project,
-            "project_name": project,
-            "version_group": version_group,
-            "builds": builds,
+def search_builds(
+    project: str,
+    version_group: Optional[str],
+    channel: Optional[str],
+    promoted: Optional[bool],
+    since: Optional[datetime],
+    until: Optional[datetime],
+    q: Optional[str],
+    limit: int,
+    offset: int,
+):
+    query = select(Project.version, Project.build).where(Project.project_id == project)
+    if channel is not None:
+        query = query.where(Project.channel == channel)
+    if promoted is not None:
+        query = query.where(Project.promoted == promoted)
+    if version_group is not None:
+        query = query.where(Project.version_group == version_group)
+    if since is not None:
+        query = query.where(Project.time >= since)
+    if until is not None:
+        query = query.where(Project.time < until)
+    if q:
+        query = query.where(
+            select(BuildCommit.hash)
+            .join(Commit, Commit.hash == BuildCommit.hash)
+            .where(BuildCommit.project_id == Project.project_id)
+            .where(BuildCommit.version == Project.version)
+            .where(BuildCommit.build == Project.build)
+            .where(match(Commit.summary, Commit.message, against=q))
+            .exists()
+        )
+    query = (
+        query.order_by(Project.time.desc(), Project.build.desc())
+        .limit(limit + 1)
+        .offset(offset)
+    )
+    with Session(bind=app.state.sql_engine) as sess:
+        return sess.execute(query).all()
+
+
+@app.get(
+    "/projects/{project}/search",
+    description="search builds by channel, promoted, time range and commit text, newest first",
+    responses={
+        200: {
+            "content": {
+                "application/json": {
+                    "example": {
+                        "project_id": "leaves",
+                        "offset": 0,
+                        "limit": 1,
+                        "next_offset": 1,
+                        "builds": [
+                            {
+                                "project_id": "leaves",
+                                "project_name": "leaves",
+                                "version": "1.20.1",
+                                "build": 3,
+                                "time": "2023-06-17T16:21:01.000Z",
+                                "channel": "default",
+                                "promoted": True,
+                                "changes": [],
+                                "downloads": {
+                                    "application": {
+                                        "name": "leaves-1.20.1.jar",
+                                        "sha256": "75201e1ebfaeb58715c08c2475db2ad24c3e75d2ec325de43f98b40ec5f819aa",
+                                        "url": "https://github.com/LeavesMC/Leaves/releases/download/1.20.1-1fbd584/leaves-1.20.1.jar",
+                                    }
+                                },
+                            }
+                        ],
+                    }
+                }
+            },
         }
+    },
+)
+@api_json_middleware
+async def search(
+    project: str = "leaves",
+    version_group: Optional[str] = None,
+    channel: Optional[str] = None,
+    promoted: Optional[bool] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    q: Optional[str] = None,
+    limit: int = 20,
+    offset: int = 0,
+):
+    index = app.state.release_index
+    if project not in index.projects:
+        raise HTTPException(status_code=404, detail=f"{project} not found")
+    if not 0 < limit <= SEARCH_MAX_LIMIT or offset < 0:
+        raise HTTPException(
+            status_code=400,
+            detail=f"limit must be between 1 and {SEARCH_MAX_LIMIT}, offset at least 0",
+        )
+    with span("sql"):
+        rows = await run_in_threadpool(
+            search_builds,
+            project,
+            version_group,
+            channel,
+            promoted,
+            since,
+            until,
+            q,
+            limit,
+            offset,
+        )
+    # the query only picks builds, their listings come from the index
+    builds = []
+    for row in rows[:limit]:
+        record = index.build(project, row.version, row.build)
+        if record is not None:
+            builds.append(build_info(record))
+    return {
+        "project_id": project,
+        "offset": offset,
+        "limit": limit,
+        "next_offset": offset + limit if len(rows) > limit else None,
+        "builds": builds,
+    }
 
 
 @app.get(
     "/projects/{project}/versions/{version}/builds/downloads/latest",
     description="get latest build info",
 )
+@api_json_middleware
 async def latest_build_info(project: str = "leaves", version: str = "1.20.1"):
-    with Session(bind=app.state.sql_engine) as sess:
-        download_result = (
-            sess.query(File.url)
-            .filter(
-                File.project_id == project,
-                File.version == version,
-            )
-            .order_by(desc(File.build))
-            .limit(1)
-            .one_or_none()
+    record = app.state.release_index.latest(project, version)
+    download = None
+    if record is not None:
+        download = record.downloads.get("application") or next(
+            iter(record.downloads.values()), None
         )
-        if download_result == None:
-            raise HTTPException(
-                status_code=404, detail=f"{project} or {version} not found"
-            )
-        return RedirectResponse(url=download_result[0])
+    if download is None:
+        raise HTTPException(status_code=404, detail=f"{project} or {version} not found")
+    if StatsConfig.enabled:
+        app.state.download_counter.hit(download)
+    return RedirectResponse(url=download_url(download))
 
 
 @app.get(
@@ -719,22 +1220,135 @@ async def latest_build_info(project: str = "leaves", version: str = "1.20.1"):
 async def download_file_by_name(
     build: int, name: str, project: str = "leaves", version: str = "1.20.1"
 ):
+    record = app.state.release_index.build(project, version, build)
+    if record is not None:
+        for download in record.downloads.values():
+            if download.name == name:
+                if StatsConfig.enabled:
+                    app.state.download_counter.hit(download)
+                return RedirectResponse(url=download_url(download))
+    raise HTTPException(
+        status_code=404, detail=f"{project} or {version} or {build} not found"
+    )
+
+
+@app.on_event("startup")
+async def _start_download_stats():
+    StatsConfig.load()
+    app.state.download_counter = DownloadCounter()
+    app.state.stats_task = asyncio.create_task(download_stats_flusher())
+
+
+@app.on_event("shutdown")
+async def _stop_download_stats():
+    app.state.stats_task.cancel()
+    await flush_download_counts()
+
+
+def save_download_counts(rows):
+    stmt = insert(DownloadStats).values(
+        [
+            {
+                "project_id": project_id,
+                "version": version,
+                "build": build,
+                "type": type,
+                "downloads": count,
+            }
+            for (project_id, version, build, type), count in rows.items()
+        ]
+    )
+    stmt = stmt.on_duplicate_key_update(
+        downloads=DownloadStats.downloads + stmt.inserted.downloads
+    )
     with Session(bind=app.state.sql_engine) as sess:
-        download_result = (
-            sess.query(File.url)
-            .filter(
-                File.project_id == project,
-                File.version == version,
-                File.build == build,
-                File.name == name,
-            )
-            .one_or_none()
-        )
-        if download_result == None:
-            raise HTTPException(
-                status_code=404, detail=f"{project} or {version} or {build} not found"
-            )
-        return RedirectResponse(url=download_result[0])
+        sess.execute(stmt)
+        sess.commit()
+
+
+async def flush_download_counts():
+    counter = app.state.download_counter
+    rows = counter.drain()
+    if not rows:
+        return
+    try:
+        await run_in_threadpool(save_download_counts, rows)
+    except sqlalchemy.exc.SQLAlchemyError as e:
+        counter.restore(rows)
+        log_event("stats_flush_failed", rows=len(rows), error=str(e))
+
+
+async def download_stats_flusher():
+    while True:
+        await asyncio.sleep(StatsConfig.flush_interval)
+        await flush_download_counts()
+
+
+def load_download_stats(project: str, version: Optional[str]):
+    query = select(
+        DownloadStats.version,
+        DownloadStats.build,
+        DownloadStats.type,
+        DownloadStats.downloads,
+    ).where(DownloadStats.project_id == project)
+    if version is not None:
+        query = query.where(DownloadStats.version == version)
+    with Session(bind=app.state.sql_engine) as sess:
+        return sess.execute(query).all()
+
+
+@app.get(
+    "/projects/{project}/stats",
+    description="get download counts per version, or per build and type of one version",
+    responses={
+        200: {
+            "content": {
+                "application/json": {
+                    "example": {
+                        "project_id": "leaves",
+                        "version": "1.20.1",
+                        "total": 1234,
+                        "builds": [
+                            {"build": 3, "downloads": {"application": 1000}},
+                            {"build": 2, "downloads": {"application": 234}},
+                        ],
+                    }
+                }
+            },
+        }
+    },
+)
+@api_json_middleware
+async def download_stats(project: str = "leaves", version: Optional[str] = None):
+    if project not in app.state.release_index.projects:
+        raise HTTPException(status_code=404, detail=f"{project} not found")
+    with span("sql"):
+        rows = await run_in_threadpool(load_download_stats, project, version)
+    total = sum(row.downloads for row in rows)
+    # counted downloads reach the DB every StatsConfig.flush_interval
+    if version is None:
+        versions = {}
+        for row in rows:
+            versions[row.version] = versions.get(row.version, 0) + row.downloads
+        return {"project_id": project, "total": total, "versions": versions}
+    builds = {}
+    for row in rows:
+        builds.setdefault(row.build, {})[row.type] = row.downloads
+    return {
+        "project_id": project,
+        "version": version,
+        "total": total,
+        "builds": [
+            {"build": build, "downloads": builds[build]}
+            for build in sorted(builds, reverse=True)
+        ],
+    }
+
+
+class DownloadData(BaseModel):
+    name: str
+    sha256: str
+    url: str
 
 
 class ReleaseData(BaseModel):
@@ -744,71 +1358,318 @@ class ReleaseData(BaseModel):
     time: str
     channel: str = "default"
     promoted: bool = False
-    changes: str
-    downloads: dict
+    # a list of {commit, summary, message}, the same as NDJSON, or "hash<<<message>>>..."
+    changes: Union[List[dict], str] = ""
+    downloads: Dict[str, DownloadData]  # type -> artifact, e.g. application, mojmap
     secret: str
 
 
+def write_release(sess: Session, data: ReleaseData, changes: List[CommitRecord]) -> int:
+    """Write one release, returning its build number.
+
+    The caller opens the transaction with ``begin``; the build number is only
+    unique if the locking read and the upserts commit together.
+    """
+    release_time = data.time.replace("T", " ").replace("Z", "")
+    # FOR UPDATE holds writers outside this worker's journal lock, e.g.
+    # replay_journal.py or another host, until this release commits
+    build = (
+        sess.query(func.max(Project.build))
+        .where(Project.version_group == data.version[:4])
+        .where(Project.project_id == data.project_id)
+        .with_for_update()
+        .one_or_none()[0]
+        or 0
+    ) + 1
+    sql_replace(
+        sess,
+        Project,
+        project_id=data.project_id,
+        project_name=data.project_name,
+        version=data.version,
+        version_group=data.version[:4],
+        time=release_time,
+        channel=data.channel,
+        promoted=data.promoted,
+        build=build,
+    )
+    sql_replace_many(
+        sess,
+        File,
+        [
+            {
+                "sha256": download.sha256,
+                "type": type,
+                "name": download.name,
+                "build": build,
+                "version": data.version,
+                "version_group": data.version[:4],
+                "project_id": data.project_id,
+                "url": download.url,
+            }
+            for type, download in data.downloads.items()
+        ],
+    )
+    sql_replace_many(
+        sess,
+        Commit,
+        [
+            {
+                "hash": commit.hash,
+                "summary": commit.summary,
+                "message": commit.message,
+            }
+            for commit in changes
+        ],
+    )
+    sql_replace_many(
+        sess,
+        BuildCommit,
+        [
+            {
+                "project_id": data.project_id,
+                "version": data.version,
+                "build": build,
+                "hash": commit.hash,
+                "version_group": data.version[:4],
+                "position": position,
+            }
+            for position, commit in enumerate(changes)
+        ],
+    )
+    return build
+
+
+def apply_journal(engine, entries: List[JournalEntry]):
+    """Write the entries not applied yet in one transaction, at most once each.
+
+    Returns the (release, build, changes) written, the entries rejected as invalid
+    and the new release generation. An unreachable DB raises, leaving everything
+    queued for the next attempt.
+    """
+    applied, rejected = [], []
+    with Session(bind=engine) as sess, span("sql"):
+        begin(sess)
+        done = set(
+            sess.execute(
+                select(AppliedRelease.entry_id)
+                .where(AppliedRelease.entry_id.in_([entry.id for entry in entries]))
+                .where(AppliedRelease.error.is_(None))
+            ).scalars()
+        )
+        for entry in entries:
+            if entry.id in done:
+                continue
+            build, error = None, None
+            try:
+                with sess.begin_nested():
+                    data = ReleaseData(**entry.release, secret="")
+                    changes = parse_changes(data.changes)
+                    build = write_release(sess, data, changes)
+            except (
+                ValueError,
+                sqlalchemy.exc.IntegrityError,
+                sqlalchemy.exc.DataError,
+            ) as e:
+                error = str(e)[:2048]
+                rejected.append(entry)
+            else:
+                applied.append((data, build, changes))
+            sql_replace(
+                sess,
+                AppliedRelease,
+                entry_id=entry.id,
+                project_id=entry.release.get("project_id"),
+                version=entry.release.get("version"),
+                build=build,
+                applied=datetime.utcnow(),
+                error=error,
+            )
+        generation = None
+        if applied:
+            bump = insert(ReleaseGeneration).values(id=1, generation=1)
+            sess.execute(
+                bump.on_duplicate_key_update(
+                    generation=ReleaseGeneration.generation + 1
+                )
+            )
+            generation = current_generation(sess)
+        sess.commit()
+    return applied, rejected, generation
+
+
+def save_registry(project_ids):
+    index = app.state.release_index
+    with Session(bind=app.state.sql_engine) as sess, span("sql"):
+        for project_id in project_ids:
+            sql_replace(sess, ProjectRegistry, **index.projects[project_id].to_dict())
+        sess.commit()
+
+
+mirror_tasks = set()
+
+
+async def publish_applied(applied, generation: Optional[int]):
+    """Show releases written by ``apply_journal`` in this worker's index."""
+    index = app.state.release_index
+    for data, build, changes in applied:
+        downloads = [
+            DownloadRecord(type, download.name, download.sha256, download.url)
+            for type, download in data.downloads.items()
+        ]
+        index.add_release(
+            BuildRecord(
+                data.project_id,
+                data.project_name,
+                data.version,
+                data.version[:4],
+                build,
+                datetime.fromisoformat(data.time.replace("T", " ").replace("Z", "")),
+                data.channel,
+                data.promoted,
+            ),
+            downloads,
+            changes,
+        )
+        if MirrorConfig.enabled:
+            task = asyncio.create_task(mirror_downloads(downloads))
+            mirror_tasks.add(task)
+            task.add_done_callback(mirror_tasks.discard)
+    if generation is not None and generation == index.generation + 1:
+        # nothing else was published meanwhile, so this index is current
+        index.generation = generation
+    if app.state.ready:
+        # before the first load the index only holds these releases; the load
+        # brings the registry in line itself
+        await run_in_threadpool(
+            save_registry, {data.project_id for data, _, _ in applied}
+        )
+
+
+async def apply_pending():
+    journal = app.state.journal
+    with journal.applier() as mine:
+        if not mine:
+            return
+        entries = await run_in_threadpool(journal.pending)
+        for start in range(0, len(entries), JournalConfig.batch_size):
+            batch = entries[start : start + JournalConfig.batch_size]
+            applied, rejected, generation = await run_in_threadpool(
+                apply_journal, app.state.sql_engine, batch
+            )
+            for entry in rejected:
+                await run_in_threadpool(journal.reject, entry)
+            if applied:
+                await publish_applied(applied, generation)
+            await run_in_threadpool(journal.remove, [entry.id for entry in batch])
+
+
+async def journal_applier():
+    while True:
+        try:
+            await asyncio.wait_for(
+                app.state.journal_wakeup.wait(), JournalConfig.interval
+            )
+        except asyncio.TimeoutError:
+            pass
+        app.state.journal_wakeup.clear()
+        try:
+            await apply_pending()
+        except Exception as e:
+            # most likely the DB is down; the entries stay queued until it is back
+            log_event("journal_apply_failed", error=str(e))
+
+
+@app.on_event("startup")
+async def _start_journal():
+    JournalConfig.load()
+    app.state.journal = ReleaseJournal(JournalConfig.path, JournalConfig.fsync)
+    app.state.journal_wakeup = asyncio.Event()
+    app.state.journal_wakeup.set()  # apply what was queued before a restart
+    app.state.journal_task = asyncio.create_task(journal_applier())
+
+
+@app.on_event("shutdown")
+async def _stop_journal():
+    app.state.journal_task.cancel()
+
+
 @app.post("/new_release", include_in_schema=False)
-@api_json_middleware
 async def new_release(data: ReleaseData):
     if data.secret != SECRET:
         return Response(status_code=403)
-    with Session(bind=app.state.sql_engine) as sess:
-        data.time = data.time.replace("T", " ").replace("Z", "")
-        build = (
-            sess.query(func.max(Project.build))
-            .where(Project.version_group == data.version[:4])
-            .where(Project.project_id == data.project_id)
-            .one_or_none()[0]
-            + 1
-        )
-        sql_replace(
-            sess,
-            Project,
-            project_id=data.project_id,
-            project_name=data.project_name,
-            version=data.version,
-            version_group=data.version[:4],
-            time=data.time,
-            channel=data.channel,
-            promoted=data.promoted,
-            build=build,
-        )
-        sql_replace(
-            sess,
-            File,
-            sha256=data.downloads["application"]["sha256"],
-            type="application",
-            name=data.downloads["application"]["name"],
-            build=build,
-            version=data.version,
-            version_group=data.version[:4],
-            project_id=data.project_id,
-            url=data.downloads["application"]["url"],
+    try:
+        parse_changes(data.changes)
+        datetime.fromisoformat(data.time.replace("T", " ").replace("Z", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # acknowledged once on disk; the applier writes it to the DB
+    with span("journal"):
+        entry = await run_in_threadpool(
+            app.state.journal.append, data.dict(exclude={"secret"})
         )
-        if data.changes != "":
-            commits = [
-                {
-                    "commit": commit.split("<<<")[0],
-                    "summary": commit.split("<<<")[1],
-                    "message": commit.split("<<<")[1],
-                }
-                for commit in data.changes.split(">>>")[:-1]
-            ]
-            for commit in commits:
-                sql_replace(
-                    sess,
-                    Commit,
-                    hash=commit["commit"],
-                    summary=commit["summary"],
-                    message=commit["message"],
-                    build=build,
-                    version=data.version,
-                    version_group=data.version[:4],
-                    project_id=data.project_id,
-                )
-        sess.commit()
+    app.state.journal_wakeup.set()
+    return JSONResponse({"id": entry.id, "queued": True}, status_code=202)
+
+
+class ProfileData(BaseModel):
+    secret: str
+    mode: str = "cprofile"  # "cprofile" or "sample"
+    seconds: float = 10
+    route: Optional[str] = None  # profile the next `requests` requests to this route
+    requests: int = 100
+    format: str = "pstats"  # "pstats" or "text", sample mode gives collapsed stacks
+
+
+class AdminData(BaseModel):
+    secret: str
+
+
+@app.post("/admin/profile", include_in_schema=False)
+async def admin_profile(data: ProfileData):
+    if data.secret != SECRET:
+        return Response(status_code=403)
+    seconds = min(data.seconds, ProfileConfig.max_seconds)
+    if data.mode == "sample":
+        sampler = SamplingProfiler()
+        await run_in_threadpool(sampler.run, seconds)
+        return Response(sampler.collapsed(), media_type="text/plain")
+
+    try:
+        if data.route is not None:
+            route = next(
+                (r for r in app.routes if getattr(r, "path", None) == data.route), None
+            )
+            if route is None:
+                raise HTTPException(status_code=404, detail=f"{data.route} not found")
+            profile = await profile_controller.profile_route(
+                route, data.requests, seconds
+            )
+        else:
+            profile = await profile_controller.profile_for(seconds)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return Response(
+        dump_profile(profile, data.format),
+        media_type="text/plain"
+        if data.format == "text"
+        else "application/octet-stream",
+    )
+
+
+@app.post("/admin/profiles/{name}", include_in_schema=False)
+async def admin_profile_dump(name: str, data: AdminData):
+    if data.secret != SECRET:
+        return Response(status_code=403)
+    path = os.path.join(ProfileConfig.dump_dir, os.path.basename(name))
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail=f"{name} not found")
+    return FileResponse(path, media_type="application/octet-stream")
+
+
+@app.on_event("startup")
+async def _setup_cdn():
+    CDNConfig.load()
 
 
 async def refresh_cdn(path: str):
@@ -825,7 +1686,7 @@ async def refresh_cdn(path: str):
             {"Type": "file", "UrlList": [f"{CDN_URL}{path}"]}
         )
     except exc.UCloudException as e:
-        print(e)
+        log_event("cdn_refresh_failed", path=path, error=str(e))
 
 
 @app.post("/upload_file", include_in_schema=False)
@@ -838,27 +1699,133 @@ async def upload_file(
 ):
     if secret != SECRET:
         return Response(status_code=403)
-    with open(os.path.join("cache", filename), "wb") as f:
-        f.write(await file.read())
-    # with open(os.path.join("cache", filename), "rb") as f:
-    # 直接读 body
-    await file.seek(0)
+    if not valid_filename(filename):
+        raise HTTPException(status_code=400, detail=f"invalid filename {filename}")
+    # verify before publishing, cache/<filename> only ever changes to a good file
+    fd, tmp = temp_file()
     sha256_obj = hashlib.sha256()
-    while True:
-        data = await file.read(65536)  # 一次读取64KB的数据
-        if not data:
-            break
-        sha256_obj.update(data)
+    with os.fdopen(fd, "wb") as f:
+        while True:
+            data = await file.read(65536)  # 一次读取64KB的数据
+            if not data:
+                break
+            sha256_obj.update(data)
+            f.write(data)
     hash = sha256_obj.hexdigest()
     if hash == str(filehash):
+        await run_in_threadpool(commit_upload, tmp, hash, filename)
+        app.state.release_index.invalidate()
         await refresh_cdn("/cache/" + filename)
         return CDN_URL + "/cache/" + filename
     else:
+        os.remove(tmp)
         return f"Hash Error {hash}"
 
 
+@app.on_event("startup")
+async def _setup_uploads():
+    UploadConfig.load()
+    app.state.upload_store = UploadStore(
+        UploadConfig.dir, UploadConfig.max_size, UploadConfig.expire_seconds
+    )
+
+
+class UploadInitData(BaseModel):
+    filename: str
+    size: int
+    sha256: str
+
+
+def upload_session(id: str, secret: str) -> UploadSession:
+    if secret != SECRET:
+        raise HTTPException(status_code=403)
+    session = app.state.upload_store.get(id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"upload {id} not found")
+    return session
+
+
+@app.post("/uploads", include_in_schema=False)
+async def upload_init(data: UploadInitData, x_secret: str = Header("")):
+    if x_secret != SECRET:
+        return Response(status_code=403)
+    try:
+        session = await run_in_threadpool(
+            app.state.upload_store.create, data.filename, data.size, data.sha256
+        )
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return session.status()
+
+
+@app.get("/uploads/{id}", include_in_schema=False)
+async def upload_status(id: str, x_secret: str = Header("")):
+    session = upload_session(id, x_secret)
+    return await run_in_threadpool(session.status)
+
+
+@app.put("/uploads/{id}", include_in_schema=False)
+async def upload_chunk(
+    id: str, offset: int, request: Request, x_secret: str = Header("")
+):
+    session = upload_session(id, x_secret)
+    store: UploadStore = app.state.upload_store
+    end = offset
+    buffer = bytearray()
+    try:
+        # straight to disk in 1MiB writes, the chunk is never held in memory whole
+        async for data in request.stream():
+            buffer += data
+            if len(buffer) >= 1 << 20:
+                await run_in_threadpool(store.store, session, end, bytes(buffer))
+                end += len(buffer)
+                buffer.clear()
+        if buffer:
+            await run_in_threadpool(store.store, session, end, bytes(buffer))
+            end += len(buffer)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    finally:
+        # record whatever was written, a retry can resume from the exact byte
+        await run_in_threadpool(store.commit, session, offset, end)
+    return await run_in_threadpool(session.status)
+
+
+def commit_upload(path: str, sha256: str, filename: str) -> str:
+    """Store a verified upload, point cache/<filename> at it and link its builds."""
+    stored = put_object(path, sha256)
+    publish_alias(sha256, filename)
+    for download in app.state.release_index.by_sha256.get(sha256, ()):
+        download.mirror_path = link_download(download)
+    return stored
+
+
+@app.post("/uploads/{id}/finalize", include_in_schema=False)
+async def upload_finalize(id: str, x_secret: str = Header("")):
+    session = upload_session(id, x_secret)
+    try:
+        path = await run_in_threadpool(app.state.upload_store.finalize, session)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    stored = await run_in_threadpool(
+        commit_upload, path, session.sha256, session.filename
+    )
+    session.discard()
+    app.state.release_index.invalidate()
+    await refresh_cdn("/cache/" + session.filename)
+    return {
+        "url": CDN_URL + "/cache/" + session.filename,
+        "mirror_url": CDN_URL + "/cache/" + stored,
+        "sha256": session.sha256,
+    }
+
+
 if __name__ == "__main__":
+    # everything else loads in startup hooks, which also run in worker processes
     WebConfig.load()
-    CDNConfig.load()
-    host, port = WebConfig.host, WebConfig.port
-    uvicorn.run(app, host=host, port=port)
+    LogConfig.load()
+    options = WebConfig.uvicorn_options()
+    # more than one worker needs an import string so each process builds its own app
+    target = "main:app" if WebConfig.workers > 1 else app
+    # our structured access log replaces uvicorn's
+    uvicorn.run(target, access_log=not LogConfig.enabled, **options)
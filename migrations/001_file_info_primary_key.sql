@@ -0,0 +1,6 @@
+-- file_info used sha256 as its primary key, so the same jar published by two
+-- builds (or as two download types) overwrote the earlier row.
+ALTER TABLE file_info
+    DROP PRIMARY KEY,
+    ADD PRIMARY KEY (project_id, version, build, type),
+    ADD INDEX ix_file_info_sha256 (sha256);
@@ -0,0 +1,24 @@
+-- commit_info was keyed by hash but also held the build, so a commit listed by a
+-- second build moved to it. Builds now point at commits through build_commit.
+-- Commits that were already moved can not be recovered and stay on the later build.
+CREATE TABLE IF NOT EXISTS build_commit (
+    project_id VARCHAR(255) NOT NULL,
+    version VARCHAR(255) NOT NULL,
+    build INTEGER NOT NULL,
+    hash CHAR(40) NOT NULL,
+    version_group VARCHAR(255),
+    position INTEGER,
+    PRIMARY KEY (project_id, version, build, hash),
+    INDEX ix_build_commit_range (project_id, version_group, build)
+);
+
+INSERT IGNORE INTO build_commit (project_id, version, build, hash, version_group, position)
+    SELECT project_id, version, build, hash, version_group, 0
+    FROM commit_info
+    WHERE build IS NOT NULL;
+
+ALTER TABLE commit_info
+    DROP COLUMN build,
+    DROP COLUMN version,
+    DROP COLUMN version_group,
+    DROP COLUMN project_id;
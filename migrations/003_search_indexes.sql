@@ -0,0 +1,3 @@
+-- indexes behind GET /projects/{project}/search
+CREATE INDEX ix_project_info_filter ON project_info (project_id, channel, promoted, time);
+CREATE FULLTEXT INDEX ix_commit_info_text ON commit_info (summary, message);
@@ -0,0 +1,5 @@
+-- PushToAPI.sh sends full commit bodies, which outgrow VARCHAR(2048); under
+-- strict mode such a release was rejected by the applier after a 202.
+ALTER TABLE commit_info
+    MODIFY message MEDIUMTEXT,
+    MODIFY summary TEXT;
@@ -0,0 +1,76 @@
+import hashlib
+import os
+import shutil
+
+import requests
+
+from artifact_store import has_object, object_path, put_object, temp_file
+
+CHUNK_SIZE = 65536
+
+
+class ChecksumMismatch(Exception):
+    def __init__(self, name: str, expected: str, actual: str):
+        super().__init__(f"{name}: expected sha256 {expected}, got {actual}")
+        self.expected = expected
+        self.actual = actual
+
+
+class HttpFetcher:
+    """Download artifacts from their release URL, following GitHub's redirects."""
+
+    def __init__(self, timeout: float = 60):
+        self.timeout = timeout
+
+    def fetch(self, url: str, fd):
+        with requests.get(url, stream=True, timeout=self.timeout) as resp:
+            resp.raise_for_status()
+            for chunk in resp.iter_content(CHUNK_SIZE):
+                fd.write(chunk)
+
+
+class LocalFetcher:
+    """Read artifacts from a local directory by the last path segment of their URL.
+
+    Lets the pipeline run without network access, e.g. against a directory of jars
+    built locally.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def fetch(self, url: str, fd):
+        with open(os.path.join(self.root, url.rsplit("/", 1)[-1]), "rb") as src:
+            shutil.copyfileobj(src, fd, CHUNK_SIZE)
+
+
+class HashingWriter:
+    def __init__(self, fd):
+        self.fd = fd
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data: bytes):
+        self.sha256.update(data)
+        self.fd.write(data)
+
+
+def mirror_artifact(fetcher, url: str, sha256: str, name: str) -> str:
+    """Fetch ``url`` once, verify it against ``sha256`` and add it to the store.
+
+    Returns the object path. Raises ``ChecksumMismatch`` and leaves nothing behind
+    when the content does not match.
+    """
+    if has_object(sha256):
+        return object_path(sha256)
+    fd, tmp = temp_file()
+    try:
+        with os.fdopen(fd, "wb") as f:
+            writer = HashingWriter(f)
+            fetcher.fetch(url, writer)
+        actual = writer.sha256.hexdigest()
+        if actual != sha256:
+            raise ChecksumMismatch(name, sha256, actual)
+        return put_object(tmp, sha256)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
@@ -0,0 +1,174 @@
+import asyncio
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from starlette.routing import Match
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def dump_profile(profile: cProfile.Profile, format: str = "pstats") -> bytes:
+    """Serialize a finished profile, as a pstats file or as a text report."""
+    if format == "text":
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).sort_stats("cumulative").print_stats(100)
+        return out.getvalue().encode("utf-8")
+    profile.create_stats()
+    return marshal.dumps(profile.stats)
+
+
+class SamplingProfiler:
+    """Sample the stacks of every thread, producing flamegraph collapsed stacks."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.counts: Counter = Counter()
+
+    def run(self, seconds: float):
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+                    )
+                    frame = frame.f_back
+                self.counts[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def collapsed(self) -> bytes:
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.counts.most_common()
+        ).encode("utf-8")
+
+
+class RouteCapture:
+    def __init__(self, route, requests: int):
+        self.route = route
+        self.remaining = requests
+        self.profile = cProfile.Profile()
+        self.active = 0
+        self.done = asyncio.Event()
+
+
+class ProfileController:
+    """Profiling state of this worker; only one cProfile session runs at a time."""
+
+    def __init__(self):
+        self.busy = False
+        self.capture: Optional[RouteCapture] = None
+        self.header_secret: Optional[str] = None  # set to accept X-Profile
+        self.dump_dir = "profiles"
+
+    def _acquire(self):
+        if self.busy:
+            raise ProfilerBusy("another profile is running")
+        self.busy = True
+
+    async def profile_for(self, seconds: float) -> cProfile.Profile:
+        """Profile everything running on the event loop for ``seconds``."""
+        self._acquire()
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+            self.busy = False
+        return profile
+
+    async def profile_route(self, route, requests: int, timeout: float):
+        """Profile the next ``requests`` requests matching ``route``, up to ``timeout``."""
+        self._acquire()
+        capture = self.capture = RouteCapture(route, requests)
+        try:
+            await asyncio.wait_for(capture.done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.capture = None
+            self.busy = False
+        return capture.profile
+
+
+class ProfileMiddleware:
+    """Runs cProfile around requests picked by the controller.
+
+    With no capture armed and X-Profile disabled a request only costs one check.
+    """
+
+    def __init__(self, app, controller: ProfileController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        controller = self.controller
+        if scope["type"] != "http" or (
+            controller.capture is None and controller.header_secret is None
+        ):
+            return await self.app(scope, receive, send)
+
+        capture = controller.capture
+        if capture is not None and capture.remaining > 0:
+            if capture.route.matches(scope)[0] == Match.FULL:
+                return await self._capture(capture, scope, receive, send)
+
+        if controller.header_secret is not None and not controller.busy:
+            for key, value in scope["headers"]:
+                if key == b"x-profile":
+                    if value.decode("latin-1") == controller.header_secret:
+                        return await self._profile_request(scope, receive, send)
+                    break
+        return await self.app(scope, receive, send)
+
+    async def _capture(self, capture: RouteCapture, scope, receive, send):
+        capture.remaining -= 1
+        capture.active += 1
+        if capture.active == 1:
+            capture.profile.enable()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            capture.active -= 1
+            if capture.active == 0:
+                capture.profile.disable()
+                if capture.remaining <= 0:
+                    capture.done.set()
+
+    async def _profile_request(self, scope, receive, send):
+        controller = self.controller
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{id(scope):x}.prof"
+
+        async def send_with_name(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile", name.encode("latin-1"))
+                ]
+            await send(message)
+
+        controller.busy = True
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            await self.app(scope, receive, send_with_name)
+        finally:
+            profile.disable()
+            controller.busy = False
+            os.makedirs(controller.dump_dir, exist_ok=True)
+            with open(os.path.join(controller.dump_dir, name), "wb") as fd:
+                fd.write(dump_profile(profile))
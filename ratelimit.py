@@ -0,0 +1,41 @@
+import time
+from collections import OrderedDict
+
+
+class TokenBucketLimiter:
+    """Per-client token bucket, kept in the memory of the current worker.
+
+    Every client key owns a bucket holding at most ``burst`` tokens which refills
+    at ``rate`` tokens per second. Idle buckets are evicted in LRU order once more
+    than ``max_clients`` keys are tracked, so memory stays bounded.
+    """
+
+    def __init__(self, rate: float, burst: int, max_clients: int = 65536):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_clients = max_clients
+        # key -> [tokens, last refill]
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+
+    def acquire(self, key: str) -> float:
+        """Take one token for ``key``.
+
+        Returns 0 when the request is allowed, otherwise the number of seconds
+        until a token becomes available.
+        """
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [self.burst, now]
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0
+        return (1 - bucket[0]) / self.rate
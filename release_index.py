@@ -0,0 +1,262 @@
+import json
+import sys
+from bisect import insort
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.000Z"
+
+
+def render_json(content) -> bytes:
+    # same encoding as fastapi's JSONResponse
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class DownloadRecord:
+    __slots__ = ("type", "name", "sha256", "url", "mirror_path", "build_record")
+
+    def __init__(self, type: str, name: str, sha256: str, url: str):
+        self.type = sys.intern(type)
+        self.name = name
+        self.sha256 = sha256
+        self.url = url
+        self.mirror_path: Optional[str] = None  # relative to the cache directory
+        self.build_record: Optional["BuildRecord"] = None
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "sha256": self.sha256, "url": self.url}
+
+
+class CommitRecord:
+    __slots__ = ("hash", "summary", "message")
+
+    def __init__(self, hash: str, summary: str, message: str):
+        self.hash = hash
+        self.summary = summary
+        self.message = message
+
+    def to_dict(self) -> dict:
+        return {"commit": self.hash, "summary": self.summary, "message": self.message}
+
+
+class BuildRecord:
+    __slots__ = (
+        "project_id",
+        "project_name",
+        "version",
+        "version_group",
+        "build",
+        "time",
+        "channel",
+        "promoted",
+        "changes",
+        "downloads",
+    )
+
+    def __init__(
+        self,
+        project_id: str,
+        project_name: str,
+        version: str,
+        version_group: str,
+        build: int,
+        time: datetime,
+        channel: str,
+        promoted: bool,
+    ):
+        # these repeat across every build, keep a single copy of each string
+        self.project_id = sys.intern(project_id)
+        self.project_name = sys.intern(project_name)
+        self.version = sys.intern(version)
+        self.version_group = sys.intern(version_group)
+        self.build = build
+        self.time = time.strftime(TIME_FORMAT)
+        self.channel = sys.intern(channel)
+        self.promoted = bool(promoted)
+        self.changes: List[CommitRecord] = []
+        self.downloads: Dict[str, DownloadRecord] = {}
+
+    def __lt__(self, other: "BuildRecord"):
+        return self.build < other.build
+
+    def to_dict(self) -> dict:
+        return {
+            "build": self.build,
+            "time": self.time,
+            "channel": self.channel,
+            "promoted": self.promoted,
+            "changes": [commit.to_dict() for commit in self.changes],
+            "downloads": {
+                type: download.to_dict() for type, download in self.downloads.items()
+            }
+            if self.downloads
+            else [],
+        }
+
+
+class ProjectRecord:
+    __slots__ = ("project_id", "project_name", "versions", "version_groups", "latest")
+
+    def __init__(self, project_id: str, project_name: str):
+        self.project_id = project_id
+        self.project_name = project_name
+        # version / version group -> time of its first build, for ordering
+        self.versions: Dict[str, str] = {}
+        self.version_groups: Dict[str, str] = {}
+        self.latest: Optional[BuildRecord] = None
+
+    def add_build(self, record: BuildRecord):
+        # build numbers restart per version group, so order by time
+        if record.time < self.versions.get(record.version, "~"):
+            self.versions[record.version] = record.time
+        if record.time < self.version_groups.get(record.version_group, "~"):
+            self.version_groups[record.version_group] = record.time
+        if self.latest is None or (record.time, record.build) >= (
+            self.latest.time,
+            self.latest.build,
+        ):
+            self.latest = record
+
+    def to_dict(self) -> dict:
+        return {
+            "project_id": self.project_id,
+            "project_name": self.project_name,
+            "version_groups": sorted(self.version_groups, key=self.version_groups.get),
+            "versions": sorted(self.versions, key=self.versions.get),
+            "latest_version": self.latest.version if self.latest else None,
+            "latest_build": self.latest.build if self.latest else None,
+        }
+
+
+class ReleaseIndex:
+    """All builds, downloads and commits of every project, held in memory.
+
+    Built once from the DB and kept current by ``add_release``. Response bodies are
+    rendered to JSON bytes on first use and cached until the builds they cover change.
+    """
+
+    def __init__(self):
+        self.builds: Dict[Tuple[str, str, int], BuildRecord] = {}
+        self.by_version: Dict[Tuple[str, str], List[BuildRecord]] = {}
+        self.by_group: Dict[Tuple[str, str], List[BuildRecord]] = {}
+        self.by_sha256: Dict[str, List[DownloadRecord]] = {}
+        self.commits: Dict[str, CommitRecord] = {}  # shared by every build listing it
+        self.projects: Dict[str, ProjectRecord] = {}
+        self._rendered: Dict[tuple, bytes] = {}
+        self.generation = 0  # release_generation the rows were read at
+
+    @classmethod
+    def from_rows(
+        cls, project_rows, file_rows, commit_rows, registry_rows=()
+    ) -> "ReleaseIndex":
+        index = cls()
+        for row in project_rows:
+            index._add_build(
+                BuildRecord(
+                    row.project_id,
+                    row.project_name,
+                    row.version,
+                    row.version_group,
+                    row.build,
+                    row.time,
+                    row.channel,
+                    row.promoted,
+                )
+            )
+        for row in file_rows:
+            record = index.builds.get((row.project_id, row.version, row.build))
+            if record is not None:
+                index._add_download(
+                    record, DownloadRecord(row.type, row.name, row.sha256, row.url)
+                )
+        for row in commit_rows:
+            record = index.builds.get((row.project_id, row.version, row.build))
+            if record is not None:
+                record.changes.append(
+                    index._intern(CommitRecord(row.hash, row.summary, row.message))
+                )
+        for row in registry_rows:
+            # the registry holds the display name, everything else follows the builds
+            project = index.projects.get(row.project_id)
+            if project is not None:
+                project.project_name = row.project_name
+        return index
+
+    def _add_build(self, record: BuildRecord):
+        key = (record.project_id, record.version, record.build)
+        old = self.builds.get(key)
+        if old is not None:
+            self.by_version[(old.project_id, old.version)].remove(old)
+            self.by_group[(old.project_id, old.version_group)].remove(old)
+            for download in old.downloads.values():
+                self.by_sha256[download.sha256].remove(download)
+        self.builds[key] = record
+        insort(
+            self.by_version.setdefault((record.project_id, record.version), []), record
+        )
+        insort(
+            self.by_group.setdefault((record.project_id, record.version_group), []),
+            record,
+        )
+        project = self.projects.get(record.project_id)
+        if project is None:
+            project = self.projects[record.project_id] = ProjectRecord(
+                record.project_id, record.project_name
+            )
+        project.add_build(record)
+
+    def _add_download(self, record: BuildRecord, download: DownloadRecord):
+        old = record.downloads.get(download.type)
+        if old is not None:
+            self.by_sha256[old.sha256].remove(old)
+        record.downloads[download.type] = download
+        download.build_record = record
+        self.by_sha256.setdefault(download.sha256, []).append(download)
+
+    def _intern(self, commit: CommitRecord) -> CommitRecord:
+        known = self.commits.get(commit.hash)
+        if known is None:
+            self.commits[commit.hash] = commit
+            return commit
+        known.summary, known.message = commit.summary, commit.message
+        return known
+
+    def add_release(
+        self,
+        record: BuildRecord,
+        downloads: List[DownloadRecord],
+        changes: List[CommitRecord],
+    ):
+        self._add_build(record)
+        self.projects[record.project_id].project_name = record.project_name
+        for download in downloads:
+            self._add_download(record, download)
+        record.changes.extend(self._intern(commit) for commit in changes)
+        self.invalidate()
+
+    def invalidate(self):
+        """Drop every cached response body, e.g. after a download got mirrored."""
+        self._rendered.clear()
+
+    def build(self, project: str, version: str, build: int) -> Optional[BuildRecord]:
+        return self.builds.get((project, version, build))
+
+    def latest(self, project: str, version: str) -> Optional[BuildRecord]:
+        builds = self.by_version.get((project, version))
+        return builds[-1] if builds else None
+
+    def versions_in_group(self, project: str, version_group: str) -> List[str]:
+        versions = []
+        for record in self.by_group.get((project, version_group), ()):
+            if record.version not in versions:
+                versions.append(record.version)
+        return versions
+
+    def rendered(self, key: tuple, render) -> bytes:
+        """Return the cached JSON body for ``key``, rendering it with ``render()`` on a miss."""
+        body = self._rendered.get(key)
+        if body is None:
+            body = self._rendered[key] = render_json(render())
+        return body
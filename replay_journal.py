@@ -0,0 +1,62 @@
+"""Apply a release journal to MySQL without a running server.
+
+    python replay_journal.py [journal] [--dry-run]
+
+For recovery: a journal copied off a host that died before its worker caught
+up, or ``<journal>.rejected`` once whatever made its entries fail is fixed.
+Entries already in the DB are skipped, so replaying twice is harmless. Running
+workers pick the releases up on their next generation check. Run it from the
+server's directory so it finds config/.
+"""
+import sys
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from config import JournalConfig
+from journal import ReleaseJournal
+from main import AppliedRelease, Base, apply_journal, make_engine
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    dry_run = "--dry-run" in sys.argv
+    JournalConfig.load()
+    journal = ReleaseJournal(args[0] if args else JournalConfig.path)
+    engine = make_engine()
+    Base.metadata.create_all(engine)
+    with journal.applier() as mine:
+        if not mine:
+            print(f"a worker is applying {journal.path}, stop it or let it finish")
+            sys.exit(1)
+        entries = journal.pending()
+        if dry_run:
+            with Session(bind=engine) as sess:
+                done = set(
+                    sess.execute(
+                        select(AppliedRelease.entry_id).where(
+                            AppliedRelease.error.is_(None)
+                        )
+                    ).scalars()
+                )
+            for entry in entries:
+                state = "applied" if entry.id in done else "pending"
+                release = entry.release
+                print(
+                    f"{entry.id} {release['project_id']} {release['version']} {state}"
+                )
+            return
+        total = rejected = 0
+        for start in range(0, len(entries), JournalConfig.batch_size):
+            batch = entries[start : start + JournalConfig.batch_size]
+            applied, failed, _ = apply_journal(engine, batch)
+            for entry in failed:
+                journal.reject(entry)
+            journal.remove([entry.id for entry in batch])
+            total += len(applied)
+            rejected += len(failed)
+        print(f"{len(entries)} entries: {total} applied, {rejected} rejected")
+
+
+if __name__ == "__main__":
+    main()
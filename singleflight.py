@@ -0,0 +1,34 @@
+import asyncio
+import functools
+
+from starlette.concurrency import run_in_threadpool
+
+
+class SingleFlight:
+    """Share one in-flight computation between concurrent callers of the same key."""
+
+    def __init__(self):
+        self._calls: dict = {}
+
+    async def do(self, key, fn, *args):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args))
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        # shield: a disconnecting client must not cancel the work other callers wait on
+        return await asyncio.shield(task)
+
+
+def coalesce(callback):
+    """Run a blocking function in the threadpool, coalescing identical concurrent calls.
+
+    Calls are keyed by their positional arguments, so every argument must be hashable.
+    """
+    flight = SingleFlight()
+
+    @functools.wraps(callback)
+    async def w(*args):
+        return await flight.do(args, run_in_threadpool, callback, *args)
+
+    return w
@@ -1,21 +1,27 @@
-from sqlalchemy import Column, VARCHAR, Integer, Boolean, DateTime, CHAR
+from sqlalchemy import (
+    Column,
+    VARCHAR,
+    Integer,
+    BigInteger,
+    Boolean,
+    DateTime,
+    CHAR,
+    JSON,
+    Index,
+    Text,
+)
 
+from sqlalchemy.dialects.mysql import MEDIUMTEXT
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
 
-PROJECTS = [
-    {
-        "project_id": "leaves",
-        "project_name": "leaves",
-        "version_groups": ["1.20"],
-        "versions": ["1.20.1"],
-    }
-]
-
 
 class Project(Base):
     __tablename__ = "project_info"
+    __table_args__ = (
+        Index("ix_project_info_filter", "project_id", "channel", "promoted", "time"),
+    )
 
     project_id = Column(VARCHAR(255), primary_key=True)
     version = Column(VARCHAR(255), primary_key=True)
@@ -30,23 +36,79 @@ class Project(Base):
 class File(Base):
     __tablename__ = "file_info"
 
-    sha256 = Column(CHAR(64), primary_key=True)
-    type = Column(VARCHAR(255))
+    project_id = Column(VARCHAR(255), primary_key=True)
+    version = Column(VARCHAR(255), primary_key=True)
+    build = Column(Integer, primary_key=True)
+    type = Column(VARCHAR(255), primary_key=True)
+    sha256 = Column(CHAR(64), index=True)
     name = Column(VARCHAR(255))
-    build = Column(Integer)
-    version = Column(VARCHAR(255))
     version_group = Column(VARCHAR(255))
     url = Column(VARCHAR(255))
-    project_id = Column(VARCHAR(255))
 
 
 class Commit(Base):
     __tablename__ = "commit_info"
+    __table_args__ = (
+        Index("ix_commit_info_text", "summary", "message", mysql_prefix="FULLTEXT"),
+    )
 
     hash = Column(CHAR(40), primary_key=True)
-    message = Column(VARCHAR(2048))
-    summary = Column(VARCHAR(2048))
-    build = Column(Integer)
-    version = Column(VARCHAR(255))
+    # full commit bodies, upstream updates carry the upstream changelog
+    message = Column(Text().with_variant(MEDIUMTEXT(), "mysql"))
+    summary = Column(Text)
+
+
+class BuildCommit(Base):
+    __tablename__ = "build_commit"
+    __table_args__ = (
+        # changes between two builds of a version group are one range scan
+        Index("ix_build_commit_range", "project_id", "version_group", "build"),
+    )
+
+    project_id = Column(VARCHAR(255), primary_key=True)
+    version = Column(VARCHAR(255), primary_key=True)
+    build = Column(Integer, primary_key=True)
+    hash = Column(CHAR(40), primary_key=True)
     version_group = Column(VARCHAR(255))
+    position = Column(Integer)  # order of the commit within the build's changes
+
+
+class ProjectRegistry(Base):
+    __tablename__ = "project_registry"
+
+    project_id = Column(VARCHAR(255), primary_key=True)
+    project_name = Column(VARCHAR(255))
+    version_groups = Column(JSON)
+    versions = Column(JSON)
+    latest_version = Column(VARCHAR(255))
+    latest_build = Column(Integer)
+
+
+class ReleaseGeneration(Base):
+    __tablename__ = "release_generation"
+
+    # a single row, bumped by every release so workers notice each other's
+    id = Column(Integer, primary_key=True)
+    generation = Column(Integer)
+
+
+class AppliedRelease(Base):
+    __tablename__ = "release_journal"
+
+    # journal entries already written, so replaying one is a no-op
+    entry_id = Column(CHAR(32), primary_key=True)
     project_id = Column(VARCHAR(255))
+    version = Column(VARCHAR(255))
+    build = Column(Integer)
+    applied = Column(DateTime)
+    error = Column(VARCHAR(2048))  # set when the entry was rejected
+
+
+class DownloadStats(Base):
+    __tablename__ = "download_stats"
+
+    project_id = Column(VARCHAR(255), primary_key=True)
+    version = Column(VARCHAR(255), primary_key=True)
+    build = Column(Integer, primary_key=True)
+    type = Column(VARCHAR(255), primary_key=True)
+    downloads = Column(BigInteger)
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope="session")
+def main(tmp_path_factory):
+    """The app module, imported in a scratch dir since it reads config/secret and
+    creates cache/ relative to the working directory."""
+    workdir = tmp_path_factory.mktemp("webapi")
+    (workdir / "config").mkdir()
+    (workdir / "config" / "secret").write_text("testsecret")
+    (workdir / "static").symlink_to(os.path.join(ROOT, "static"))
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import main
+    finally:
+        os.chdir(cwd)
+    return main
@@ -0,0 +1,108 @@
+import pytest
+
+from changelog import MAX_SUMMARY, ChangelogError, parse_changes
+
+HASH = "413f258fb864102e41379fb8fe99d214af4c5bc9"
+
+
+def hashes(records):
+    return [record.hash for record in records]
+
+
+def test_long_commit_message_is_kept():
+    # "Update Paper" with the upstream changelog in its body
+    message = "Update Paper\n\n" + "\n".join(f"- upstream fix {i}" for i in range(500))
+    assert len(message) > 2048
+    (record,) = parse_changes([{"commit": HASH, "message": message}])
+    assert record.summary == "Update Paper"
+    assert record.message == message
+
+
+def test_summary_too_long_for_the_column_is_rejected():
+    with pytest.raises(ChangelogError):
+        parse_changes([{"commit": HASH, "message": "x" * (MAX_SUMMARY + 1)}])
+
+
+def test_list_of_changes():
+    records = parse_changes(
+        [
+            {"commit": "ABCDEF1", "summary": "short", "message": "long\nbody"},
+            {"commit": HASH, "message": "first line\nsecond line"},
+        ]
+    )
+    assert hashes(records) == ["abcdef1", HASH]
+    assert records[0].summary == "short" and records[0].message == "long\nbody"
+    assert records[1].summary == "first line"
+
+
+def test_ndjson():
+    payload = '{"commit": "abcdef1", "message": "a"}\n{"commit": "abcdef2"}\n'
+    records = parse_changes(payload)
+    assert hashes(records) == ["abcdef1", "abcdef2"]
+    assert records[1].message == "" and records[1].summary == ""
+
+
+def test_json_array_sent_as_a_string():
+    payload = '[{"commit": "abcdef1", "message": "a"}, {"commit": "abcdef2"}]'
+    assert hashes(parse_changes(payload)) == ["abcdef1", "abcdef2"]
+
+
+def test_invalid_json_is_rejected():
+    with pytest.raises(ChangelogError):
+        parse_changes('{"commit": "abcdef1"')
+
+
+def test_legacy_string():
+    records = parse_changes("abcdef1<<<first>>>abcdef2<<<second>>>\n")
+    assert hashes(records) == ["abcdef1", "abcdef2"]
+    assert [record.summary for record in records] == ["first", "second"]
+
+
+def test_empty_changes():
+    assert parse_changes("") == []
+    assert parse_changes([]) == []
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        "garbage",
+        "abcdef1<<<first>>>abcdef2<<<second",
+        "abcdef1 first>>>",
+    ],
+)
+def test_legacy_string_without_closing_delimiter_is_rejected(payload):
+    with pytest.raises(ChangelogError):
+        parse_changes(payload)
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        {"commit": "xyz1234"},
+        {"commit": "abc12"},
+        {"commit": "a" * 41},
+        {"commit": None},
+        {"message": "no hash"},
+        "abcdef1",
+        {"commit": "abcdef1", "message": 1},
+        {"commit": "abcdef1", "summary": ["x"]},
+    ],
+)
+def test_invalid_change_is_rejected(change):
+    with pytest.raises(ChangelogError):
+        parse_changes([change])
+
+
+def test_repeated_hashes_keep_the_first():
+    records = parse_changes(
+        [
+            {"commit": "abcdef1", "message": "first"},
+            {"commit": "ABCDEF1", "message": "again"},
+            {"commit": "abcdef2", "message": "second"},
+        ]
+    )
+    assert hashes(records) == ["abcdef1", "abcdef2"]
+    assert records[0].message == "first"
+    legacy = parse_changes("abcdef1<<<a>>>abcdef1<<<b>>>")
+    assert [record.summary for record in legacy] == ["a"]
@@ -0,0 +1,61 @@
+import json
+
+from journal import ReleaseJournal, entry_id
+
+
+def release(build_time: str = "2023-07-01T00:00:00Z") -> dict:
+    return {"project_id": "leaves", "version": "1.20.1", "time": build_time}
+
+
+def test_pending_keeps_order_and_drops_repeats(tmp_path):
+    journal = ReleaseJournal(str(tmp_path / "releases.ndjson"), fsync=False)
+    first = journal.append(release("2023-07-01T00:00:00Z"))
+    second = journal.append(release("2023-07-02T00:00:00Z"))
+    # a retrying CI job sends the same payload again
+    repeated = journal.append(release("2023-07-01T00:00:00Z"))
+    assert repeated.id == first.id == entry_id(release("2023-07-01T00:00:00Z"))
+    assert [entry.id for entry in journal.pending()] == [first.id, second.id]
+
+
+def test_torn_last_line_is_skipped(tmp_path):
+    path = tmp_path / "releases.ndjson"
+    journal = ReleaseJournal(str(path), fsync=False)
+    entry = journal.append(release())
+    with open(path, "a", encoding="utf-8") as fd:
+        fd.write('{"id": "abc", "received": 1.0, "rel')
+    assert [e.id for e in journal.pending()] == [entry.id]
+
+
+def test_remove_keeps_other_entries(tmp_path):
+    path = tmp_path / "releases.ndjson"
+    journal = ReleaseJournal(str(path), fsync=False)
+    first = journal.append(release("2023-07-01T00:00:00Z"))
+    second = journal.append(release("2023-07-02T00:00:00Z"))
+    journal.remove([first.id])
+    assert [entry.id for entry in journal.pending()] == [second.id]
+    third = journal.append(release("2023-07-03T00:00:00Z"))
+    assert [entry.id for entry in journal.pending()] == [second.id, third.id]
+    journal.remove([second.id, third.id])
+    assert journal.pending() == []
+    assert path.read_text() == ""
+
+
+def test_reject_sets_entry_aside(tmp_path):
+    path = tmp_path / "releases.ndjson"
+    journal = ReleaseJournal(str(path), fsync=False)
+    entry = journal.append(release())
+    journal.reject(entry)
+    rejected = [json.loads(line) for line in open(str(path) + ".rejected")]
+    assert rejected == [entry.to_dict()]
+    # rejecting does not remove, that is up to the applier
+    assert [e.id for e in journal.pending()] == [entry.id]
+
+
+def test_only_one_applier(tmp_path):
+    journal = ReleaseJournal(str(tmp_path / "releases.ndjson"), fsync=False)
+    with journal.applier() as mine:
+        assert mine
+        with journal.applier() as other:
+            assert not other
+    with journal.applier() as mine:
+        assert mine
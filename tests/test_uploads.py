@@ -0,0 +1,170 @@
+import hashlib
+import os
+import random
+import threading
+import time
+
+import pytest
+
+from uploads import UploadError, UploadStore, merge_ranges
+
+CHUNK = 4096
+
+
+@pytest.fixture
+def store(tmp_path):
+    return UploadStore(str(tmp_path / "uploads"), max_size=1 << 20, expire_seconds=60)
+
+
+@pytest.fixture
+def data():
+    return os.urandom(10 * CHUNK + 123)
+
+
+def create(store, data):
+    return store.create(
+        "leaves-1.20.1.jar", len(data), hashlib.sha256(data).hexdigest()
+    )
+
+
+def put(store, session, data, offset, size=CHUNK):
+    chunk = data[offset : offset + size]
+    store.store(session, offset, chunk)
+    store.commit(session, offset, offset + len(chunk))
+
+
+def offsets(data):
+    return list(range(0, len(data), CHUNK))
+
+
+def test_merge_ranges():
+    assert merge_ranges([(5, 8), (0, 3), (3, 4), (7, 10)]) == [(0, 4), (5, 10)]
+
+
+def test_chunks_in_order(store, data):
+    session = create(store, data)
+    for offset in offsets(data):
+        put(store, session, data, offset)
+    with open(store.finalize(session), "rb") as fd:
+        assert fd.read() == data
+
+
+def test_chunks_out_of_order_and_in_parallel(store, data):
+    session = create(store, data)
+    shuffled = offsets(data)
+    random.Random(1).shuffle(shuffled)
+    threads = [
+        threading.Thread(target=put, args=(store, session, data, offset))
+        for offset in shuffled
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert session.status()["complete"]
+    with open(store.finalize(session), "rb") as fd:
+        assert fd.read() == data
+
+
+def test_resume_after_a_partial_chunk(store, data):
+    session = create(store, data)
+    # the connection dropped 1000 bytes into the second chunk
+    put(store, session, data, 0)
+    put(store, session, data, CHUNK, size=1000)
+    assert session.missing() == [(CHUNK + 1000, len(data))]
+    put(store, session, data, CHUNK + 1000, size=len(data))
+    assert store.finalize(session)
+
+
+def test_hash_follows_the_contiguous_prefix(store, data):
+    session = create(store, data)
+    put(store, session, data, 2 * CHUNK)
+    assert store.advance_hash(session)[1] == 0
+    put(store, session, data, 0)
+    assert store.advance_hash(session)[1] == CHUNK
+    put(store, session, data, CHUNK)
+    hasher, end = store.advance_hash(session)
+    assert end == 3 * CHUNK
+    assert hasher.hexdigest() == hashlib.sha256(data[:end]).hexdigest()
+
+
+def test_resent_range_with_other_bytes(store, data):
+    session = create(store, data)
+    broken = bytearray(data)
+    broken[10] ^= 0xFF
+    put(store, session, bytes(broken), 0)
+    for offset in offsets(data)[1:]:
+        put(store, session, data, offset)
+    # the client noticed and sends the first chunk again
+    put(store, session, data, 0)
+    with open(store.finalize(session), "rb") as fd:
+        assert fd.read() == data
+
+
+def test_resent_range_stored_by_another_worker(store, data):
+    other = UploadStore(store.dir, store.max_size, store.expire_seconds)
+    session = create(store, data)
+    broken = bytearray(data)
+    broken[10] ^= 0xFF
+    put(store, session, bytes(broken), 0)
+    put(other, other.get(session.id), data, 0)
+    for offset in offsets(data)[1:]:
+        put(store, session, data, offset)
+    with open(store.finalize(session), "rb") as fd:
+        assert fd.read() == data
+
+
+def test_hash_mismatch_discards_the_upload(store, data):
+    session = store.create("leaves-1.20.1.jar", len(data), "0" * 64)
+    for offset in offsets(data):
+        put(store, session, data, offset)
+    with pytest.raises(UploadError) as e:
+        store.finalize(session)
+    assert e.value.status_code == 400
+    assert store.get(session.id) is None
+    assert os.listdir(store.dir) == []
+
+
+def test_incomplete_upload_can_not_be_finalized(store, data):
+    session = create(store, data)
+    put(store, session, data, 0)
+    with pytest.raises(UploadError) as e:
+        store.finalize(session)
+    assert e.value.status_code == 409
+
+
+@pytest.mark.parametrize("offset, size", [(-1, 10), (10 * CHUNK + 100, 100)])
+def test_chunk_outside_the_declared_size(store, data, offset, size):
+    session = create(store, data)
+    with pytest.raises(UploadError) as e:
+        store.store(session, offset, b"x" * size)
+    assert e.value.status_code == 416
+
+
+@pytest.mark.parametrize(
+    "filename, size, sha256",
+    [
+        ("../leaves.jar", 10, "a" * 64),
+        ("builds/leaves/1.20.1/3/leaves-1.20.1.jar", 10, "a" * 64),
+        ("", 10, "a" * 64),
+        (".hidden", 10, "a" * 64),
+        ("leaves.jar", 0, "a" * 64),
+        ("leaves.jar", (1 << 20) + 1, "a" * 64),
+        ("leaves.jar", 10, "not a hash"),
+    ],
+)
+def test_invalid_upload_is_refused(store, filename, size, sha256):
+    with pytest.raises(UploadError) as e:
+        store.create(filename, size, sha256)
+    assert e.value.status_code == 400
+
+
+def test_expired_sessions_are_removed(store, data):
+    old = create(store, data)
+    put(store, old, data, 0)
+    store.expire_seconds = 0
+    time.sleep(0.01)
+    store.expire()
+    assert store.get(old.id) is None
+    assert os.listdir(store.dir) == []
+    assert store.get("not-a-session-id") is None
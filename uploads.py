@@ -0,0 +1,249 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+CHUNK_SIZE = 65536
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class UploadError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def valid_filename(filename: str) -> bool:
+    """A plain name in cache/, not a path or one of the store's dotfiles."""
+    return (
+        bool(filename)
+        and os.path.basename(filename) == filename
+        and not filename.startswith(".")
+    )
+
+
+def merge_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class UploadSession:
+    """One resumable upload, kept entirely on disk so any worker can serve it.
+
+    ``<id>.json`` holds the expected size and sha256, ``<id>.part`` the data at its
+    final offsets and ``<id>.ranges`` one "start end" line per stored chunk.
+    """
+
+    def __init__(
+        self, dir: str, id: str, filename: str, size: int, sha256: str, created: float
+    ):
+        self.dir = dir
+        self.id = id
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256
+        self.created = created
+
+    @property
+    def part(self) -> str:
+        return os.path.join(self.dir, self.id + ".part")
+
+    @property
+    def _meta(self) -> str:
+        return os.path.join(self.dir, self.id + ".json")
+
+    @property
+    def _ranges(self) -> str:
+        return os.path.join(self.dir, self.id + ".ranges")
+
+    def received(self) -> List[Tuple[int, int]]:
+        if not os.path.exists(self._ranges):
+            return []
+        with open(self._ranges, "r") as fd:
+            ranges = [tuple(map(int, line.split())) for line in fd if line.strip()]
+        return merge_ranges(ranges)
+
+    def missing(self) -> List[Tuple[int, int]]:
+        missing, offset = [], 0
+        for start, end in self.received():
+            if start > offset:
+                missing.append((offset, start))
+            offset = max(offset, end)
+        if offset < self.size:
+            missing.append((offset, self.size))
+        return missing
+
+    def write(self, offset: int, data: bytes):
+        fd = os.open(self.part, os.O_WRONLY)
+        try:
+            os.pwrite(fd, data, offset)
+        finally:
+            os.close(fd)
+
+    def mark(self, start: int, end: int):
+        # O_APPEND keeps concurrent writers from different workers line-atomic
+        fd = os.open(self._ranges, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, f"{start} {end}\n".encode())
+        finally:
+            os.close(fd)
+
+    def status(self) -> dict:
+        received = self.received()
+        missing = self.missing()
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "size": self.size,
+            "sha256": self.sha256,
+            "received": sum(end - start for start, end in received),
+            "missing": [list(r) for r in missing],
+            "complete": not missing,
+        }
+
+    def discard(self):
+        for path in (self.part, self._meta, self._ranges):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class UploadStore:
+    """Creates and finds upload sessions, and hashes their data as it arrives.
+
+    Every stored chunk extends the hash over the contiguous prefix received so far,
+    so finalizing normally only has to hash the last chunk.
+    """
+
+    def __init__(self, dir: str, max_size: int, expire_seconds: float):
+        self.dir = dir
+        self.max_size = max_size
+        self.expire_seconds = expire_seconds
+        self._hashers: Dict[str, Tuple["hashlib._Hash", int]] = {}
+        # _lock only guards the dicts, hashing holds the lock of its session
+        self._session_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        os.makedirs(dir, exist_ok=True)
+
+    def create(self, filename: str, size: int, sha256: str) -> UploadSession:
+        if not valid_filename(filename):
+            raise UploadError(400, f"invalid filename {filename}")
+        if not 0 < size <= self.max_size:
+            raise UploadError(400, f"size must be between 1 and {self.max_size}")
+        sha256 = sha256.lower()
+        if not SHA256_RE.match(sha256):
+            raise UploadError(400, "sha256 must be 64 hex digits")
+        self.expire()
+        session = UploadSession(
+            self.dir, uuid.uuid4().hex, filename, size, sha256, time.time()
+        )
+        with open(session.part, "wb") as fd:
+            fd.truncate(size)
+        with open(session._meta, "w") as fd:
+            json.dump(
+                {
+                    "filename": filename,
+                    "size": size,
+                    "sha256": sha256,
+                    "created": session.created,
+                },
+                fd,
+            )
+        return session
+
+    def get(self, id: str) -> Optional[UploadSession]:
+        if not re.match(r"^[0-9a-f]{32}$", id):
+            return None
+        try:
+            with open(os.path.join(self.dir, id + ".json"), "r") as fd:
+                meta = json.load(fd)
+        except FileNotFoundError:
+            return None
+        return UploadSession(
+            self.dir,
+            id,
+            meta["filename"],
+            meta["size"],
+            meta["sha256"],
+            meta["created"],
+        )
+
+    def store(self, session: UploadSession, offset: int, data: bytes):
+        """Write ``data`` at ``offset``; call ``commit`` once the chunk is complete."""
+        if offset < 0 or offset + len(data) > session.size:
+            raise UploadError(416, f"chunk exceeds the declared size {session.size}")
+        session.write(offset, data)
+        with self._session_lock(session.id):
+            hashed = self._hashers.get(session.id)
+            if hashed is not None and offset < hashed[1]:
+                # a range sent again after it was hashed, maybe with other bytes
+                del self._hashers[session.id]
+
+    def commit(self, session: UploadSession, start: int, end: int):
+        if end > start:
+            session.mark(start, end)
+            self.advance_hash(session)
+
+    def _session_lock(self, id: str) -> threading.Lock:
+        with self._lock:
+            return self._session_locks.setdefault(id, threading.Lock())
+
+    def _forget(self, id: str):
+        with self._lock:
+            self._hashers.pop(id, None)
+            self._session_locks.pop(id, None)
+
+    def advance_hash(self, session: UploadSession) -> Tuple["hashlib._Hash", int]:
+        with self._session_lock(session.id):
+            hasher, offset = self._hashers.get(session.id) or (hashlib.sha256(), 0)
+            end = offset
+            for start, stop in session.received():
+                if start <= end < stop:
+                    end = stop
+            if end > offset:
+                with open(session.part, "rb") as fd:
+                    fd.seek(offset)
+                    remaining = end - offset
+                    while remaining:
+                        data = fd.read(min(CHUNK_SIZE * 16, remaining))
+                        hasher.update(data)
+                        remaining -= len(data)
+            self._hashers[session.id] = (hasher, end)
+            return hasher, end
+
+    def finalize(self, session: UploadSession) -> str:
+        """Verify a complete upload, returning the path of its data file."""
+        if session.missing():
+            raise UploadError(409, "upload is incomplete")
+        hasher, _ = self.advance_hash(session)
+        self._forget(session.id)
+        digest = hasher.hexdigest()
+        if digest != session.sha256:
+            # another worker may have stored a resent range into what was hashed
+            # here, so check the whole file before giving up on it
+            hasher, _ = self.advance_hash(session)
+            self._forget(session.id)
+            digest = hasher.hexdigest()
+        if digest != session.sha256:
+            session.discard()
+            raise UploadError(400, f"Hash Error {digest}")
+        return session.part
+
+    def expire(self):
+        deadline = time.time() - self.expire_seconds
+        for name in os.listdir(self.dir):
+            if name.endswith(".json"):
+                session = self.get(name[: -len(".json")])
+                if session is not None and session.created < deadline:
+                    session.discard()
+                    self._forget(session.id)